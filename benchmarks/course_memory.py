@@ -0,0 +1,73 @@
+"""
+Measures memory held per Course, as built from parsed pages.
+
+Compares Course (slotted, interned strings, Meeting tuples) with the former
+layout: an instance dictionary per course and a dictionary per meeting.
+
+Usage: python benchmarks/course_memory.py [number of courses]
+"""
+from davislib import Course, Term
+from datetime import timedelta
+import sys
+import tracemalloc
+
+class LegacyCourse(object):
+    """
+    Course as stored before slots: attributes in an instance dictionary,
+    meetings as dictionaries with timedelta times
+    """
+    def __init__(self, crn, term, **kwargs):
+        self.crn = crn
+        self.term = term
+        for name in Course.__slots__:
+            if name not in ('crn', 'term'):
+                setattr(self, name, kwargs.get(name))
+
+def parsed(text):
+    """
+    Returns copy of text, as each parsed page produces its own string objects
+    """
+    return ''.join(list(text))
+
+def course_attrs(i):
+    """
+    Returns attributes of synthetic two-meeting section i
+    """
+    return dict(name=parsed('ECS 0{:02d}'.format(i % 50)),
+                number=parsed('0{:02d}'.format(i % 50)),
+                section=parsed('A0{}'.format(i % 9)),
+                title=parsed('Intro to Something'),
+                units=4.0,
+                instructor=parsed('Sean Davis'),
+                subject_code=parsed('ECS'),
+                ge_areas=[parsed('Science & Engineering')],
+                available_seats=3,
+                max_enrollment=99,
+                meetings=[{'days': parsed('MWF'),
+                           'times': (timedelta(hours=10), timedelta(hours=10, minutes=50)),
+                           'location': parsed('Storer 1322'),
+                           'type': parsed('LEC')},
+                          {'days': parsed('R'),
+                           'times': (timedelta(hours=14), timedelta(hours=14, minutes=50)),
+                           'location': parsed('Wellman 2'),
+                           'type': parsed('DIS')}])
+
+def bytes_per_course(cls, n):
+    term = Term(2015, 'fall')
+    tracemalloc.start()
+    courses = [cls(str(10000 + i), term, **course_attrs(i)) for i in range(n)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size // len(courses)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    legacy = bytes_per_course(LegacyCourse, n)
+    current = bytes_per_course(Course, n)
+
+    print('{} synthetic two-meeting sections'.format(n))
+    print('dictionary layout: {:6d} bytes/course'.format(legacy))
+    print('Course:            {:6d} bytes/course ({:.0%})'.format(current, current / legacy))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Measures decoding of a large Schedule Builder course search response.
+
+Compares the former decoding (a dictionary per row, every nested JSON string
+decoded up front) with _QueryRow views, and whole-response decoding with
+streamed decoding.
+
+Usage:
+    python benchmarks/course_query.py [response file]
+        Benchmarks response file, by default benchmarks/data/course_search.json.gz
+    python benchmarks/course_query.py --record YEAR SESSION SUBJECT [response file]
+        Logs in, and records response to course search for SUBJECT in term
+    python benchmarks/course_query.py --synthesize [response file]
+        Writes a synthetic 5000 section response in Schedule Builder's column layout
+
+The response shipped in benchmarks/data was synthesized, as recording one
+requires a UC Davis login; record one to benchmark a real response.
+"""
+from davislib import ScheduleBuilder, Term
+from davislib.schedule_builder import _CourseQueryDecoder, _query_rows
+from getpass import getpass
+import gzip
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'course_search.json.gz')
+CHUNK_SIZE = ScheduleBuilder.STREAM_CHUNK_SIZE
+
+def legacy_rows(json_obj):
+    """
+    Former decoding: a dictionary per row, nested results decoded up front
+    """
+    rows = [dict(zip(json_obj['COLUMNS'], values)) for values in json_obj['DATA']]
+    for index, row in enumerate(rows):
+        rows[index] = {key: legacy_rows(json.loads(value)['QUERY'])
+                       if isinstance(value, str) and value.startswith('{"QUERY":') else value
+                       for key, value in row.items()}
+    return rows
+
+def best_of(repeat, func):
+    """
+    Returns tuple (lowest seconds taken by func, its result)
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def peak_memory(func):
+    """
+    Returns peak bytes allocated while running func
+    """
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def stream_rows(body):
+    """
+    Returns number of rows decoded from body in chunks, keeping none of them
+    """
+    decoder = _CourseQueryDecoder()
+    count = 0
+    for start in range(0, len(body), CHUNK_SIZE):
+        decoder.feed(body[start:start + CHUNK_SIZE])
+        count += len(decoder.pop_rows())
+    decoder.close()
+    return count + len(decoder.pop_rows())
+
+def benchmark(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        body = f.read()
+    sb = ScheduleBuilder(None, None)
+    term = Term(2015, 'fall')
+
+    seconds, results = best_of(5, lambda: json.loads(body)['Results'])
+    print('{}: {} rows, {:.1f} MB'.format(path, len(results['DATA']), len(body) / 2**20))
+    print('json.loads:                          {:.3f}s'.format(seconds))
+
+    def crns_and_seats(rows):
+        return [(row['PASSEDCRN'], row['BLEND_SEATS_AVAIL']) for row in rows]
+
+    seconds, _ = best_of(5, lambda: crns_and_seats(legacy_rows(results)))
+    print('dictionary rows, read crn and seats: {:.3f}s'.format(seconds))
+    seconds, _ = best_of(5, lambda: crns_and_seats(_query_rows(results)))
+    print('_QueryRow, read crn and seats:       {:.3f}s'.format(seconds))
+
+    seconds, _ = best_of(3, lambda: [sb._course_from_query_response(term, row)
+                                     for row in _query_rows(results)])
+    print('Course objects:                      {:.3f}s'.format(seconds))
+    seconds, _ = best_of(3, lambda: [sb._lazy_course_from_query_response(term, row, fields=())
+                                     for row in _query_rows(results)])
+    print('LazyCourse objects, no lazy fields:  {:.3f}s'.format(seconds))
+
+    whole = peak_memory(lambda: len(json.loads(body)['Results']['DATA']))
+    streamed = peak_memory(lambda: stream_rows(body))
+    print('peak memory decoding whole response: {:.1f} MB'.format(whole / 2**20))
+    print('peak memory decoding in chunks:      {:.1f} MB'.format(streamed / 2**20))
+
+def record(year, session, subject, path):
+    """
+    Writes raw response to course search for subject
+    """
+    username = input('Enter kerberos username: ')
+    password = getpass('Enter kerberos password: ')
+    sb = ScheduleBuilder(username, password)
+    term = Term(int(year), session)
+
+    sb.get(sb.HOME_ENDPOINT, params={'termCode': term.code})
+    r = sb.post(sb.COURSE_SEARCH_ENDPOINT, data=sb._course_query_data(term, subject=subject))
+    write(path, r.text)
+
+def synthesize(path, n=5000):
+    """
+    Writes synthetic response listing n sections, with the columns
+    Schedule Builder responds with and course parsers read
+    """
+    rand = random.Random(0)
+
+    def query(columns, data):
+        return json.dumps({'QUERY': {'COLUMNS': columns, 'DATA': data}})
+
+    columns = ['PASSEDCRN', 'SUBJECT_CODE', 'COURSE_NUMBER', 'SEC', 'TITLE', 'DESCRIPTION',
+               'CONSENTOFINSRUCTORREQUIRED', 'UNITS_LOW', 'UNITS_HIGH', 'INSTRUCTORS',
+               'GE3CREDIT', 'BLEND_SEATS_AVAIL', 'BLEND_WAIT_COUNT', 'COURSEMEETINGDATA',
+               'FINALEXAMSTARTDATE', 'ALLOWEDDROPDESC', 'PREREQUISITES']
+    # Columns no parser reads
+    columns += ['COLUMN_{}'.format(i) for i in range(40)]
+
+    data = list()
+    for i in range(n):
+        start = rand.randrange(7, 20)
+        instructors = query(['PRIMARY_IND', 'FIRST_NAME', 'LAST_NAME', 'EMAIL'],
+                            [['Y', 'First{}'.format(i % 300), 'Last{}'.format(i % 700),
+                              'instructor{}@ucdavis.edu'.format(i % 700)],
+                             ['N', 'Assistant', 'Teaching', 'ta@ucdavis.edu']])
+        meetings = query(['WEEKDAYS', 'BEGIN_TIME', 'END_TIME', 'BLDG_DESC', 'ROOM',
+                          'MEET_TYPE_DESC_SHORT'],
+                         [[rand.choice(['M,W,F', 'T,R', 'M,W']), '{:02d}10'.format(start),
+                           '{:02d}00'.format(start + 1), 'Wellman', str(rand.randrange(1, 300)),
+                           'LEC'],
+                          ['R', None, None, 'TBA', None, 'DIS']])
+        data.append(['{:05d}'.format(30000 + i), 'ECS', '{:03d}'.format(i % 200),
+                     'A{:02d}'.format(i % 12), ' Course Title {} '.format(i),
+                     'Description of course {}.\r\nSecond line.'.format(i),
+                     rand.choice(['0', '1']), '4.0', '0.0', instructors,
+                     rand.choice(['AH,SE', 'SE,QL', 'SS', '']), rand.randrange(0, 50),
+                     rand.randrange(0, 10), meetings, 'December, 10 2015 08:00:00',
+                     '20 Day Drop', 'ECS 020; ECS 030'] +
+                    [rand.choice(['', 'N', 'Y', 'value {}'.format(i)]) for _ in range(40)])
+
+    write(path, json.dumps({'Results': {'COLUMNS': columns, 'DATA': data}}))
+
+def write(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Without timestamp, so that rewriting the same response leaves the file unchanged
+    with gzip.GzipFile(path, 'wb', mtime=0) as f:
+        f.write(text.encode('utf-8'))
+    print('Wrote {}'.format(path))
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ['--record']:
+        record(*args[1:4], path=args[4] if len(args) > 4 else DEFAULT_PATH)
+    elif args[:1] == ['--synthesize']:
+        synthesize(args[1] if len(args) > 1 else DEFAULT_PATH)
+    else:
+        benchmark(args[0] if args else DEFAULT_PATH)
+
+if __name__ == '__main__':
+    main()
@@ -6,4 +6,8 @@ from . import registrar
 from .registrar import Registrar
 from .sisweb import Sisweb
 from .schedule_builder import ScheduleBuilder
-from .models import Term, Session
+from .models import Term, Session, Course, LazyCourse, Meeting, Grade, Transcript, set_html_parser
+from .cache import ResponseCache
+from .catalog import Catalog
+from .index import CourseIndex
+from .watcher import SeatWatcher, SeatChange
@@ -0,0 +1,708 @@
+"""
+davislib.aio
+
+This module provides asyncio versions of the applications.
+Requires aiohttp.
+
+Each class exposes the same public methods as its synchronous
+counterpart, as coroutines:
+>>> async with AsyncRegistrar() as r:
+...     course = await r.course_detail(term, crn)
+"""
+from .models import Application, ProtectedApplication, InvalidLoginError, Term
+from .registrar import QueryError, Registrar, _CourseQueryParser
+from .sisweb import Sisweb, _NavigationState
+from .schedule_builder import RegistrationAttempt, ScheduleBuilder, _CourseQueryDecoder
+from datetime import datetime
+import asyncio
+import aiohttp
+import codecs
+import contextlib
+import logging
+import requests
+import time
+
+class AsyncResponse(object):
+    """
+    Response container, fully read so that it may be parsed
+    like a requests.Response
+    """
+    def __init__(self, url, status_code, headers, content, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.text = text
+
+class _ClientSession(object):
+    """
+    Lazily creates an aiohttp.ClientSession, which must be created
+    from within a running event loop. Shared between applications
+    the same way Application shares its requests.Session.
+    """
+    def __init__(self, limit, headers):
+        self.limit = limit
+        self.headers = headers
+        self.session = None
+
+    def get(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self.session = aiohttp.ClientSession(connector=connector,
+                                                 headers=self.headers)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+class AsyncApplication(object):
+    """
+    Base class for UC Davis web app, using an asyncio transport
+    """
+    USER_AGENT = Application.USER_AGENT
+
+    def __init__(self, shared_app=None, limit=100):
+        """
+        Parameters:
+            (optional) shared_app: object deriving from AsyncApplication
+                                   whose session will be used in new object
+                                   (Specify this parameter if you wish to share cookies)
+            (optional) limit: maximum number of simultaneous connections
+        """
+        if shared_app:
+            if isinstance(shared_app, AsyncApplication):
+                self.s = shared_app.s
+            else:
+                raise ValueError("shared_app does not derive from AsyncApplication")
+        else:
+            self.s = _ClientSession(limit, {'User-Agent': self.USER_AGENT})
+
+    async def close(self):
+        """
+        Closes underlying connection pool
+        """
+        await self.s.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def request(self, method, base, endpoint, **kwargs):
+        """
+        Parameters:
+            method: 'get' or 'post'
+            base: application base url
+            endpoint: path appended to base
+            (optional) params, data: encoded exactly as requests would encode them
+            other keyword arguments are passed to aiohttp
+        """
+        async with AsyncApplication.stream(self, method, base, endpoint, **kwargs) as r:
+            content = await r.read()
+            text = await r.text(errors='replace')
+            return AsyncResponse(str(r.url), r.status, r.headers, content, text)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, base, endpoint, **kwargs):
+        """
+        Asynchronous context manager sending request and providing the
+        aiohttp.ClientResponse before its body is read, e.g. to read it in chunks
+        Parameters:
+            see AsyncApplication.request
+        """
+        prepared = requests.Request(method.upper(), ''.join([base, endpoint]),
+                                    params=kwargs.pop('params', None),
+                                    data=kwargs.pop('data', None)).prepare()
+
+        async with self.s.get().request(prepared.method, prepared.url,
+                                        data=prepared.body,
+                                        headers=dict(prepared.headers),
+                                        **kwargs) as r:
+            yield r
+
+    async def get(self, *args, **kwargs):
+        """
+        Executes GET request on application BASE at endpoint
+        Parameters:
+            see AsyncApplication.request
+        """
+        return await self.request('get', self.__class__.BASE, *args, **kwargs)
+
+    async def post(self, *args, **kwargs):
+        """
+        Executes POST request on application BASE at endpoint
+        Parameters:
+            see AsyncApplication.request
+        """
+        return await self.request('post', self.__class__.BASE, *args, **kwargs)
+
+class AsyncProtectedApplication(AsyncApplication):
+    """
+    Base class for UC Davis web app relying on CAS, using an asyncio transport
+    """
+    def __init__(self, username, password, shared_app=None, limit=100):
+        """
+        Parameters:
+            see ProtectedApplication
+        """
+        super(__class__, self).__init__(shared_app=shared_app, limit=limit)
+
+        if isinstance(shared_app, __class__):
+            # Share authentication state so concurrent re-auths are coalesced
+            self.auth_service = shared_app.auth_service
+        if username and password:
+            self.auth_service = self.CAS(username, password, shared_app=self)
+
+    async def request(self, method, base, endpoint, **kwargs):
+        """
+        See AsyncApplication for main functionality
+        Ensures user is authenticated before returning response
+        """
+        generation = self._auth_generation()
+        r = await super(__class__, self).request(method, base, endpoint, **kwargs)
+
+        if 'cas.ucdavis' not in r.url:
+            # already authed
+            return r
+        else:
+            # re-auth then send request again
+            await self.auth_service.reauth(generation)
+            return await super(__class__, self).request(method, base, endpoint, **kwargs)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, method, base, endpoint, **kwargs):
+        """
+        See AsyncApplication.stream
+        Ensures user is authenticated before providing response
+        """
+        generation = self._auth_generation()
+        async with super(__class__, self).stream(method, base, endpoint, **kwargs) as r:
+            if 'cas.ucdavis' not in str(r.url):
+                yield r
+                return
+
+        await self.auth_service.reauth(generation)
+        async with super(__class__, self).stream(method, base, endpoint, **kwargs) as r:
+            yield r
+
+    _auth_generation = ProtectedApplication._auth_generation
+
+    class CAS(AsyncApplication, ProtectedApplication.CAS):
+        def __init__(self, username, password, shared_app):
+            AsyncApplication.__init__(self, shared_app=shared_app)
+
+            self.username = username
+            self.password = password
+
+            # Incremented on each login, so that coroutines which were
+            # redirected by the same expired session log in only once
+            self.generation = 0
+            self._lock = asyncio.Lock()
+
+        async def reauth(self, generation=None):
+            """
+            Logs in unless another coroutine has done so since generation
+            Returns boolean representing if this call logged in.
+            """
+            async with self._lock:
+                if generation is not None and self.generation != generation:
+                    return False
+                await self.auth()
+                self.generation += 1
+                return True
+
+        async def auth(self):
+            auth_page = await self.get(self.LOGIN_ENDPOINT)
+            if self._logged_in(auth_page.text):
+                return # already logged in
+
+            action, data = self._login_form(auth_page.text)
+            r = await self.post(action, data=data)
+            if not self._logged_in(r.text):
+                raise InvalidLoginError()
+
+class AsyncRegistrar(AsyncApplication, Registrar):
+    """
+    Asyncio interface to university registrar
+    See Registrar
+    """
+    async def course_detail(self, term, crn):
+        """
+        See Registrar.course_detail
+        """
+        params = {'crn': crn,
+                  'termCode': term.code}
+
+        r = await self.get(self.COURSE_DETAIL_ENDPOINT, params=params)
+
+        return self._course_from_detail_page(r.text, term, crn)
+
+    async def course_details(self, term, crns, max_workers=8, on_error=None):
+        """
+        Asynchronous generator yielding Course objects in order of completion
+        See Registrar.course_details
+        """
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(crn):
+            async with semaphore:
+                try:
+                    return crn, await self.course_detail(term, crn), None
+                except Exception as e:
+                    return crn, None, e
+
+        tasks = [asyncio.ensure_future(fetch(crn)) for crn in crns]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                crn, course, e = await next_done
+                if e is not None:
+                    if on_error:
+                        on_error(crn, e)
+                    else:
+                        logging.warning('Could not fetch CRN %s (%s): %r', crn, term, e)
+                    continue
+
+                yield course
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def course_query(self, term, **kwargs):
+        """
+        See Registrar.course_query
+        """
+        return [crn async for crn in self.iter_course_query(term, **kwargs)]
+
+    async def planned_course_query(self, term, max_workers=8, allow_partial=False, **kwargs):
+        """
+        See Registrar.planned_course_query
+        """
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def query_once(query):
+            async with semaphore:
+                return await self.course_query(term, **query)
+
+        crns = set()
+        pending = [kwargs]
+        while pending:
+            results = await asyncio.gather(*[query_once(query) for query in pending],
+                                           return_exceptions=True)
+            queries, pending = pending, list()
+            for query, result in zip(queries, results):
+                if isinstance(result, QueryError):
+                    pending.extend(self._refine_query(term, query, result, allow_partial))
+                elif isinstance(result, BaseException):
+                    raise result
+                else:
+                    crns.update(result)
+
+        return list(crns)
+
+    async def iter_course_query(self, term, **kwargs):
+        """
+        Asynchronous generator yielding unique course CRNs as they are read from the response
+        See Registrar.iter_course_query
+        """
+        if not isinstance(term, Term):
+            raise ValueError("provided term is not an instance of Term class")
+
+        query = self._map_params(term, **kwargs)
+        async with self.stream('post', self.BASE, self.COURSE_SEARCH_ENDPOINT, data=query) as r:
+            parser = _CourseQueryParser()
+            decoder = codecs.getincrementaldecoder(r.charset or 'utf-8')(errors='replace')
+            async for chunk in r.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                for crn in parser.pop_crns():
+                    yield crn
+
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+            for crn in parser.pop_crns():
+                yield crn
+
+class _AsyncNavigationState(_NavigationState):
+    """
+    _NavigationState of an AsyncSisweb session, with asyncio locks held while
+    renewing the session ID and while selecting terms. Sisweb holds its lock
+    for both; an asyncio.Lock is not reentrant, and term selection renews the session.
+    """
+    def __init__(self):
+        super(__class__, self).__init__()
+        self.session_lock = asyncio.Lock()
+        self.select_lock = asyncio.Lock()
+
+class AsyncSisweb(AsyncProtectedApplication, Sisweb):
+    """
+    Asyncio interface to the UC Davis Student Information Service
+    See Sisweb
+    """
+    def __init__(self, username, password, shared_app=None, limit=100):
+        """
+        Parameters:
+            see ProtectedApplication
+        """
+        super(__class__, self).__init__(username, password, shared_app=shared_app, limit=limit)
+
+        if isinstance(shared_app, __class__) and shared_app.s is self.s:
+            # Same Sisweb session, same server-side state
+            self._navigation = shared_app._navigation
+        else:
+            self._navigation = _AsyncNavigationState()
+
+    async def request(self, method, base, endpoint, **kwargs):
+        """
+        See Sisweb.request
+        """
+        await self._ensure_session()
+        r = await super(__class__, self).request(method, base, endpoint, **kwargs)
+
+        if self._session_expired(r):
+            # Terms selected in the expired session are no longer selected
+            self._navigation.reset(self._auth_generation())
+            r = await super(__class__, self).request(method, base, endpoint, **kwargs)
+
+        self._navigation.session_expires = time.time() + self.SESSION_TTL
+        return r
+
+    async def _ensure_session(self):
+        """
+        See Sisweb._ensure_session
+        """
+        state = self._navigation_state()
+        if time.time() < state.session_expires - self.SESSION_REFRESH_MARGIN:
+            return
+
+        async with state.session_lock:
+            # Another coroutine may have renewed it while this one waited
+            if time.time() < state.session_expires - self.SESSION_REFRESH_MARGIN:
+                return
+
+            r = await super(__class__, self).request('get', self.BASE, self.MAIN_MENU_ENDPOINT)
+            if self._session_expired(r) or state.generation != self._auth_generation():
+                state.reset(self._auth_generation())
+            state.session_expires = time.time() + self.SESSION_TTL
+
+    async def _terms(self, endpoint):
+        """
+        See Sisweb._terms
+        """
+        state = self._navigation_state()
+        expires, terms = state.term_lists.get(endpoint, (0, None))
+        if expires > time.time():
+            return list(terms)
+
+        r = await self.get(endpoint)
+        terms = self._term_list(r.text)
+        state.term_lists[endpoint] = (time.time() + self.TERM_LIST_TTL, terms)
+        return list(terms)
+
+    async def course_query(self, term, subject,
+        number=None, title=None, credit_range=('', ''), start=0, end=0, days=None):
+        """
+        See Sisweb.course_query
+        """
+        params = self._course_query_params(term, subject, credit_range, start, end)
+        for attempt in range(2):
+            await self._select_course_search_term(term)
+            r = await self.post(self.COURSE_QUERY_ENDPOINT, data=params)
+            if self._navigation_state().course_search_term == term:
+                break
+            # Session was reset during query, so term was no longer selected
+
+        return self._parse_course_query(r.text, term)
+
+    async def _select_course_search_term(self, term):
+        """
+        See Sisweb._select_course_search_term
+        """
+        state = self._navigation_state()
+        async with state.select_lock:
+            if state.course_search_term == term:
+                return
+
+            await self.get(self.MAIN_MENU_ENDPOINT)
+            await self.get(self.COURSE_SEARCH_ENDPOINT)
+            await self.post(self.COURSE_LOOKUP_ENDPOINT, data=self._course_lookup_params(term))
+            self._navigation_state().course_search_term = term
+
+    async def terms_enrolled(self):
+        """
+        See Sisweb.terms_enrolled
+        """
+        return await self._terms(self.REGISTRATION_TERM_SELECT_ENDPOINT)
+
+    async def terms_completed(self):
+        """
+        See Sisweb.terms_completed
+        """
+        return await self._terms(self.GRADE_TERM_SELECT_ENDPOINT)
+
+    async def courses_enrolled(self, term):
+        """
+        See Sisweb.courses_enrolled
+        """
+        self._check_term(term)
+
+        if term not in await self._terms(self.REGISTRATION_TERM_SELECT_ENDPOINT):
+            raise ValueError("Invalid term: User does not have enrollment "
+                             "information available for {}".format(term))
+        for attempt in range(2):
+            state = self._navigation_state()
+            async with state.select_lock:
+                if state.registration_term != term:
+                    data = {'term_in': term.code}
+                    await self.post(self.REGISTRATION_TERM_STORE_ENDPOINT, data=data)
+                    self._navigation_state().registration_term = term
+
+            r = await self.get(self.COURSE_SCHEDULE_ENDPOINT)
+            if self._navigation_state().registration_term == term:
+                break
+            # Session was reset during request, so term was no longer selected
+
+        return self._parse_courses_enrolled(r.text)
+
+    async def grades(self, term):
+        """
+        See Sisweb.grades
+        """
+        self._check_term(term)
+
+        if term not in await self._terms(self.GRADE_TERM_SELECT_ENDPOINT):
+            raise ValueError("User does not have final grades available for {}".format(term))
+
+        grades = await self._fetch_grades(term)
+        if grades is None:
+            raise ValueError("No undergraduate grades listed for {}".format(term))
+        return grades
+
+    async def _fetch_grades(self, term):
+        """
+        See Sisweb._fetch_grades
+        """
+        data = {'term_in': term.code}
+        r = await self.post(self.GRADE_ENDPOINT, data=data)
+        return self._parse_grades(r.text)
+
+    async def transcript(self, max_workers=4):
+        """
+        See Sisweb.transcript
+        """
+        terms = await self.terms_completed()
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(term):
+            async with semaphore:
+                return await self._fetch_grades(term)
+
+        term_grades = await asyncio.gather(*[fetch(term) for term in terms])
+        return self._transcript(terms, term_grades)
+
+def term_sensitive(func):
+    """
+    See schedule_builder.term_sensitive
+    """
+    async def visit_sb_index(self, term, *args, **kwargs):
+        await self._visit_term(term)
+        return await func(self, term, *args, **kwargs)
+    return visit_sb_index
+
+class AsyncScheduleBuilder(AsyncProtectedApplication, ScheduleBuilder):
+    """
+    Asyncio interface to Schedule Builder
+    See ScheduleBuilder
+    """
+    def __init__(self, *args, **kwargs):
+        super(__class__, self).__init__(*args, **kwargs)
+
+        self.last_term_visited = None
+
+    async def _visit_term(self, term):
+        """
+        Selects term in Schedule Builder, unless it was the last term visited
+        """
+        if self.last_term_visited != term:
+            await self.get('{}?termCode={}'.format(self.HOME_ENDPOINT, term.code))
+            self.last_term_visited = term
+
+    async def course_query(self, term, lazy=False, fields=None, **kwargs):
+        """
+        See ScheduleBuilder.course_query
+        """
+        return [course async for course in
+                self.iter_course_query(term, lazy=lazy, fields=fields, **kwargs)]
+
+    async def iter_course_query(self, term, lazy=False, fields=None, **kwargs):
+        """
+        Asynchronous generator yielding course objects as they are decoded from the response
+        See ScheduleBuilder.iter_course_query
+        """
+        await self._visit_term(term)
+
+        data = self._course_query_data(term, **kwargs)
+        if lazy or fields is not None:
+            make_course = lambda row: self._lazy_course_from_query_response(term, row, fields)
+        else:
+            make_course = lambda row: self._course_from_query_response(term, row)
+
+        # Schedule Builder occasionally responds without results; retry once
+        for attempt in range(2):
+            async with self.stream('post', self.BASE, self.COURSE_SEARCH_ENDPOINT, data=data) as r:
+                decoder = _CourseQueryDecoder()
+                text_decoder = codecs.getincrementaldecoder(r.charset or 'utf-8')(errors='replace')
+                async for chunk in r.content.iter_chunked(self.STREAM_CHUNK_SIZE):
+                    decoder.feed(text_decoder.decode(chunk))
+                    for row in decoder.pop_rows():
+                        yield make_course(row)
+
+                decoder.feed(text_decoder.decode(b'', final=True))
+                decoder.close()
+                for row in decoder.pop_rows():
+                    yield make_course(row)
+
+            if decoder.found_results:
+                return
+
+        raise KeyError('Results')
+
+    async def registered_courses(self, term):
+        """
+        See ScheduleBuilder.registered_courses
+        """
+        r = await self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+        return self._parse_registered_courses(r.text)
+
+    async def pass_times(self, term):
+        """
+        See ScheduleBuilder.pass_times
+        """
+        r = await self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+        return self._parse_pass_times(r.text)
+
+    async def schedules(self, term, include_units=False):
+        """
+        See ScheduleBuilder.schedules
+        """
+        r = await self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+        return self._parse_schedules(r.text, include_units)
+
+    @term_sensitive
+    async def add_course(self, term, schedule, crn):
+        """
+        See ScheduleBuilder.add_course
+        """
+        query = self._schedule_change_query(term, schedule, crn)
+        await self.get(self.ADD_COURSE_ENDPOINT, params=query)
+
+    @term_sensitive
+    async def remove_course(self, term, schedule, crn):
+        """
+        See ScheduleBuilder.remove_course
+        """
+        query = self._schedule_change_query(term, schedule, crn)
+        await self.get(self.REMOVE_COURSE_ENDPOINT, params=query)
+
+    async def register_schedule(self, term, schedule, allow_waitlisting=True, at=None,
+                                precise=False, retry_for=0):
+        """
+        See ScheduleBuilder.register_schedule
+        """
+        items = (await self.schedules(term, include_units=True))[schedule]
+        if precise and at:
+            return await self.register_courses_at(term, schedule, items, at,
+                                                  allow_waitlisting, retry_for)
+        return await self.register_courses(term, schedule, items, allow_waitlisting, at, retry_for)
+
+    @term_sensitive
+    async def register_courses(self, term, schedule, items, allow_waitlisting=True, at=None,
+                               retry_for=0):
+        """
+        See ScheduleBuilder.register_courses
+        """
+        if at:
+            seconds = (at - datetime.now()).total_seconds()
+            if seconds > 0:
+                await asyncio.sleep(seconds)
+
+        return await self._register(term, schedule, items, allow_waitlisting, time.time(),
+                                    retry_for=retry_for)
+
+    async def register_courses_at(self, term, schedule, items, at, allow_waitlisting=True,
+                                  retry_for=0):
+        """
+        See ScheduleBuilder.register_courses_at
+        Note that the final REGISTRATION_SPIN seconds are busy-waited, blocking the event loop.
+        """
+        target = at.timestamp()
+
+        await self._sleep_until(target - self.REGISTRATION_PREWARM)
+        await self.auth_service.reauth()
+        offset, uncertainty = await self._clock_offset(term)
+        self.last_term_visited = term
+
+        # Local time at which Schedule Builder's clock reads target
+        local_target = target - offset
+        if time.time() < local_target - self.REGISTRATION_KEEPALIVE:
+            # Reopen connection if it was closed since prewarming
+            await self._sleep_until(local_target - self.REGISTRATION_KEEPALIVE)
+            await self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+
+        await self._sleep_until(local_target - self.REGISTRATION_SPIN)
+        deadline = time.perf_counter() + (local_target - time.time())
+        while time.perf_counter() < deadline:
+            pass
+
+        return await self._register(term, schedule, items, allow_waitlisting, target,
+                                    offset, uncertainty, retry_for)
+
+    async def _register(self, term, schedule, items, allow_waitlisting, target,
+                        offset=0.0, uncertainty=None, retry_for=0):
+        """
+        See ScheduleBuilder._register
+        """
+        attempts = list()
+        deadline = None
+        while True:
+            query = self._registration_query(term, schedule, items, allow_waitlisting)
+            sent = time.time()
+            r = await self.get(self.REGISTER_ENDPOINT, params=query)
+            received = time.time()
+
+            if deadline is None:
+                deadline = sent + retry_for
+
+            error = self._registration_error(r.text)
+            attempts.append(RegistrationAttempt(target, offset, uncertainty,
+                                                sent + offset, received + offset, error))
+            if error is None:
+                return attempts
+
+            await asyncio.sleep(self._registration_retry_delay(attempts, deadline))
+
+    async def _clock_offset(self, term):
+        """
+        See ScheduleBuilder._clock_offset
+        """
+        samples = list()
+        for sample in range(self.CLOCK_SAMPLES):
+            if sample:
+                # Spread samples across server clock's one-second resolution
+                await asyncio.sleep(1.0 / self.CLOCK_SAMPLES)
+
+            sent = time.time()
+            r = await self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+            samples.append((sent, time.time(), r.headers.get('Date')))
+
+        return self._estimate_clock_offset(samples)
+
+    async def _sleep_until(self, timestamp):
+        """
+        See ScheduleBuilder._sleep_until
+        """
+        seconds = timestamp - time.time()
+        while seconds > 0:
+            await asyncio.sleep(seconds)
+            seconds = timestamp - time.time()
@@ -0,0 +1,152 @@
+"""
+davislib.cache
+
+This module provides a persistent cache for application responses.
+"""
+from requests.structures import CaseInsensitiveDict
+import hashlib
+import json
+import os
+import requests
+import sqlite3
+import threading
+import time
+
+class ResponseCache(object):
+    """
+    On-disk (SQLite) cache of HTTP responses, shared by applications
+    >>> cache = ResponseCache('~/.davislib_cache.sqlite')
+    >>> r = Registrar(cache=cache)
+
+    Only responses from endpoints listed in an application's CACHE_TTLS
+    (or in ttls) are cached, each for the number of seconds given.
+    """
+    def __init__(self, path, max_size=64 * 2**20, ttls=None):
+        """
+        Parameters:
+            path: SQLite database file, created if it does not exist
+            max_size: maximum total size of cached bodies, in bytes.
+                      Least recently used responses are evicted beyond this size.
+            ttls: optional dictionary {endpoint: seconds} overriding
+                  application CACHE_TTLS. A ttl of 0 disables caching of endpoint.
+        """
+        self.max_size = max_size
+        self.ttls = ttls or dict()
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.expanduser(path),
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                             'key TEXT PRIMARY KEY, namespace TEXT, url TEXT, '
+                             'status INTEGER, headers TEXT, encoding TEXT, body BLOB, '
+                             'size INTEGER, expires REAL, accessed REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed '
+                             'ON responses (accessed)')
+
+    def ttl(self, app, endpoint):
+        """
+        Returns number of seconds responses from endpoint may be cached for app,
+        or None if they may not be cached
+        Parameters:
+            app: Application object
+            endpoint: endpoint, optionally followed by query string
+        """
+        path = endpoint.partition('?')[0]
+        for ttls in (self.ttls, app.CACHE_TTLS):
+            for key in (endpoint, path):
+                if key in ttls:
+                    return ttls[key]
+
+        return None
+
+    def key(self, namespace, method, url, params=None, data=None):
+        """
+        Returns cache key for request
+        Parameters:
+            namespace: string isolating cached responses, e.g. username
+            method: 'get' or 'post'
+            url: full request url
+            params, data: as passed to requests
+        """
+        prepared = requests.Request(method.upper(), url, params=params, data=data).prepare()
+        body = prepared.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        digest = hashlib.sha256()
+        for part in (namespace.encode('utf-8'), prepared.method.encode('utf-8'),
+                     prepared.url.encode('utf-8'), body):
+            digest.update(part)
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns cached requests.Response for key, or None if missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT url, status, headers, encoding, body FROM responses '
+                                   'WHERE key = ? AND expires > ?', (key, now)).fetchone()
+            if not row:
+                return None
+
+            with self._db:
+                self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+
+        url, status, headers, encoding, body = row
+        r = requests.Response()
+        r.url = url
+        r.status_code = status
+        r.headers = CaseInsensitiveDict(json.loads(headers))
+        r.encoding = encoding
+        r._content = body
+        r._content_consumed = True
+        r.from_cache = True
+        return r
+
+    def set(self, key, namespace, response, ttl):
+        """
+        Stores response under key for ttl seconds, then evicts least
+        recently used responses while the cache exceeds max_size
+        """
+        now = time.time()
+        body = response.content
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (key, namespace, response.url, response.status_code,
+                              json.dumps(dict(response.headers)), response.encoding,
+                              body, len(body), now + ttl, now))
+            self._db.execute('DELETE FROM responses WHERE expires <= ?', (now,))
+            self._evict()
+
+    def _evict(self):
+        size, = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+        if size <= self.max_size:
+            return
+
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed')
+        evicted = list()
+        for key, entry_size in rows:
+            if size <= self.max_size:
+                break
+            evicted.append((key,))
+            size -= entry_size
+
+        self._db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def clear(self, namespace=None):
+        """
+        Removes all cached responses, or only those in namespace
+        """
+        with self._lock, self._db:
+            if namespace is None:
+                self._db.execute('DELETE FROM responses')
+            else:
+                self._db.execute('DELETE FROM responses WHERE namespace = ?', (namespace,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,231 @@
+"""
+davislib.catalog
+
+This module provides a local, indexed snapshot of the courses offered in a term.
+"""
+from .models import Course, Meeting, Term
+from .registrar import QueryError, Registrar
+from datetime import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class Catalog(object):
+    """
+    SQLite snapshot of every course in a term
+    >>> catalog = Catalog('~/catalog.sqlite')
+    >>> catalog.build(Term(2015, 'spring'))
+    >>> catalog.refresh(Term(2015, 'spring'), Sisweb(username, password))
+    """
+    # Fields which change during registration, refreshed by Catalog.refresh
+    VOLATILE_FIELDS = ('available_seats', 'wl_length', 'max_enrollment')
+    # Remaining fields, fetched once by Catalog.build
+    FIELDS = ('name', 'number', 'section', 'title', 'units', 'instructor',
+              'instructor_email', 'instructor_consent_required', 'subject_code',
+              'subject', 'ge_areas', 'wl_capacity', 'xl_capacity', 'xl_length',
+              'meetings', 'description', 'final_exam', 'drop_time', 'prerequisites')
+
+    def __init__(self, path, registrar=None):
+        """
+        Parameters:
+            path: SQLite database file, created if it does not exist
+            (optional) registrar: Registrar object used to build snapshots
+        """
+        self.registrar = registrar or Registrar()
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.expanduser(path), check_same_thread=False)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS snapshots ('
+                             'term TEXT PRIMARY KEY, built REAL, refreshed REAL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS courses ('
+                             'term TEXT, crn TEXT, subject_code TEXT, name TEXT, '
+                             'instructor TEXT, available_seats INTEGER, wl_length INTEGER, '
+                             'max_enrollment INTEGER, data TEXT, '
+                             'PRIMARY KEY (term, crn))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS courses_subject '
+                             'ON courses (term, subject_code)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS courses_name '
+                             'ON courses (term, name)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS courses_instructor '
+                             'ON courses (term, instructor)')
+
+    def build(self, term, subjects=None, max_workers=8, allow_partial=False):
+        """
+        Crawls registrar for every course in term and replaces term's snapshot.
+        Returns number of courses stored.
+        Parameters:
+            term: Term object
+            (optional) subjects: list of subject codes to crawl. Defaults to all subjects.
+            (optional) max_workers: maximum number of requests in flight at once
+            (optional) allow_partial: see Registrar.planned_course_query. If False,
+                                      raises QueryError rather than storing an incomplete snapshot,
+                                      including when details of any course can't be fetched.
+                                      If True, such courses are left out of the snapshot.
+        """
+        if subjects is None:
+            crns = self.registrar.planned_course_query(term, max_workers=max_workers,
+                                                       allow_partial=allow_partial)
+        else:
+            crns = set()
+            for subject in subjects:
+                crns.update(self.registrar.planned_course_query(term, max_workers=max_workers,
+                                                                allow_partial=allow_partial,
+                                                                subject=subject))
+
+        failed = list()
+        def on_error(crn, error):
+            logging.warning('Could not fetch CRN %s (%s): %r', crn, term, error)
+            failed.append(crn)
+
+        rows = [self._row(course)
+                for course in self.registrar.course_details(term, crns, max_workers=max_workers,
+                                                            on_error=on_error)]
+        if failed and not allow_partial:
+            raise QueryError('Could not fetch details of CRNs {}; snapshot of {} left unchanged'
+                             .format(', '.join(sorted(failed)), term))
+
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM courses WHERE term = ?', (term.code,))
+            self._db.executemany('INSERT INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.execute('INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)',
+                             (term.code, now, now))
+
+        return len(rows)
+
+    def refresh(self, term, app):
+        """
+        Updates volatile fields (available_seats, wl_length, max_enrollment)
+        of term's snapshot with a single course search per subject,
+        rather than refetching each course's details.
+        Returns number of courses updated.
+        Parameters:
+            term: Term object
+            app: object providing course_query(term, subject=...) returning Course objects
+                 including seat counts, e.g. Sisweb or ScheduleBuilder
+        """
+        with self._lock:
+            subjects = [subject for subject, in self._db.execute(
+                'SELECT DISTINCT subject_code FROM courses WHERE term = ?', (term.code,))]
+
+        updates = list()
+        for subject in subjects:
+            for course in app.course_query(term, subject=subject):
+                values = [self._int(getattr(course, field, None)) for field in self.VOLATILE_FIELDS]
+                # Sources that don't provide a field leave its stored value unchanged
+                updates.append(values + [term.code, course.crn])
+
+        updated = 0
+        with self._lock, self._db:
+            for update in updates:
+                cursor = self._db.execute('UPDATE courses SET '
+                                          'available_seats = COALESCE(?, available_seats), '
+                                          'wl_length = COALESCE(?, wl_length), '
+                                          'max_enrollment = COALESCE(?, max_enrollment) '
+                                          'WHERE term = ? AND crn = ?', update)
+                updated += cursor.rowcount
+            self._db.execute('UPDATE snapshots SET refreshed = ? WHERE term = ?',
+                             (time.time(), term.code))
+
+        return updated
+
+    def terms(self):
+        """
+        Returns list of Term for which snapshots exist
+        """
+        with self._lock:
+            codes = [code for code, in self._db.execute('SELECT term FROM snapshots ORDER BY term')]
+
+        return [Term(code[0:4], code[4:]) for code in codes]
+
+    def course(self, term, crn):
+        """
+        Returns Course with crn from term's snapshot, or None if not found
+        """
+        courses = self._select(term, 'crn = ?', (crn,))
+        return courses[0] if courses else None
+
+    def courses(self, term, subject=None, name=None, instructor=None):
+        """
+        Returns list of Course in term's snapshot matching all provided filters
+        Parameters:
+            term: Term object
+            (optional) subject: subject code, e.g. 'ECS'
+            (optional) name: course name, e.g. 'ECS 040'
+            (optional) instructor: instructor name string
+        """
+        clauses, args = ['1'], []
+        for column, value in (('subject_code', subject),
+                              ('name', name),
+                              ('instructor', instructor)):
+            if value is not None:
+                clauses.append('{} = ?'.format(column))
+                args.append(value)
+
+        return self._select(term, ' AND '.join(clauses), args)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _select(self, term, where, args):
+        with self._lock:
+            rows = self._db.execute('SELECT crn, available_seats, wl_length, max_enrollment, data '
+                                    'FROM courses WHERE term = ? AND ' + where + ' ORDER BY crn',
+                                    [term.code] + list(args)).fetchall()
+
+        courses = list()
+        for crn, available_seats, wl_length, max_enrollment, data in rows:
+            attrs = self._decode(json.loads(data))
+            attrs.update(available_seats=available_seats,
+                         wl_length=wl_length,
+                         max_enrollment=max_enrollment)
+            courses.append(Course(crn, term, **attrs))
+
+        return courses
+
+    def _row(self, course):
+        data = json.dumps(self._encode(course))
+        return (course.term.code, course.crn, course.subject_code, course.name,
+                course.instructor, course.available_seats, course.wl_length,
+                course.max_enrollment, data)
+
+    def _encode(self, course):
+        """
+        Returns JSON-serializable dictionary of course's non-volatile fields
+        """
+        attrs = {field: getattr(course, field) for field in self.FIELDS}
+
+        if attrs['meetings'] is not None:
+            # [days, start, end, location, type]
+            attrs['meetings'] = [list(meeting) for meeting in attrs['meetings']]
+
+        if isinstance(attrs['final_exam'], datetime):
+            attrs['final_exam'] = {'datetime': attrs['final_exam'].isoformat()}
+
+        return attrs
+
+    def _decode(self, attrs):
+        """
+        Returns Course attributes represented by dictionary created by Catalog._encode
+        """
+        if isinstance(attrs['units'], list):
+            attrs['units'] = tuple(attrs['units'])
+
+        if attrs['meetings'] is not None:
+            attrs['meetings'] = [Meeting(*meeting) for meeting in attrs['meetings']]
+
+        if isinstance(attrs['final_exam'], dict):
+            attrs['final_exam'] = datetime.fromisoformat(attrs['final_exam']['datetime'])
+
+        return attrs
+
+    def _int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
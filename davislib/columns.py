@@ -0,0 +1,105 @@
+"""
+davislib.columns
+
+This module exports collections of courses as columns, for vectorized analytics.
+to_arrays requires numpy.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Numeric columns, None where unknown
+NUMERIC_COLUMNS = ('available_seats', 'max_enrollment', 'wl_length',
+                   'units_low', 'units_high', 'meeting_minutes')
+# Dictionary-encoded columns
+CATEGORICAL_COLUMNS = ('term', 'subject_code', 'name', 'instructor')
+
+def to_columns(courses):
+    """
+    Returns dictionary of columns for list of Course:
+        'crn': list of CRNs
+        numeric columns (see NUMERIC_COLUMNS): list of numbers, None where unknown
+            meeting_minutes is scheduled minutes per week
+        categorical columns (see CATEGORICAL_COLUMNS): tuple (codes, categories),
+            where codes is list of indexes into categories, -1 where unknown.
+            Terms are encoded by term code.
+    Parameters:
+        courses: iterable of Course
+    """
+    columns = {'crn': list()}
+    columns.update((name, list()) for name in NUMERIC_COLUMNS)
+    categories = {name: dict() for name in CATEGORICAL_COLUMNS}
+    codes = {name: list() for name in CATEGORICAL_COLUMNS}
+
+    for course in courses:
+        columns['crn'].append(course.crn)
+        columns['available_seats'].append(_number(course.available_seats))
+        columns['max_enrollment'].append(_number(course.max_enrollment))
+        columns['wl_length'].append(_number(course.wl_length))
+
+        units = course.units
+        if not isinstance(units, tuple):
+            units = (units, units)
+        columns['units_low'].append(_number(units[0]))
+        columns['units_high'].append(_number(units[1]))
+
+        minutes = None
+        if course.meetings is not None:
+            minutes = sum((m.end - m.start) * len(m.days or '')
+                          for m in course.meetings if m.start is not None)
+        columns['meeting_minutes'].append(minutes)
+
+        values = {'term': course.term.code if course.term else None,
+                  'subject_code': course.subject_code,
+                  'name': course.name,
+                  'instructor': course.instructor}
+        for name, value in values.items():
+            if value is None:
+                codes[name].append(-1)
+            else:
+                codes[name].append(categories[name].setdefault(value, len(categories[name])))
+
+    for name in CATEGORICAL_COLUMNS:
+        columns[name] = (codes[name], list(categories[name]))
+
+    return columns
+
+def to_arrays(courses):
+    """
+    Returns dictionary of NumPy arrays for list of Course, laid out as in to_columns:
+        'crn': array of CRN strings
+        numeric columns: float64 arrays, NaN where unknown
+        categorical columns: tuple (int32 codes array, list of categories), -1 where unknown
+    >>> arrays = to_arrays(courses)
+    >>> fill = 1 - arrays['available_seats'] / arrays['max_enrollment']
+    Parameters:
+        courses: iterable of Course
+    """
+    if numpy is None:
+        raise ImportError('to_arrays requires numpy')
+
+    columns = to_columns(courses)
+    arrays = {'crn': numpy.array(columns['crn'], dtype=str)}
+    for name in NUMERIC_COLUMNS:
+        arrays[name] = numpy.array([numpy.nan if v is None else v for v in columns[name]],
+                                   dtype=numpy.float64)
+    for name in CATEGORICAL_COLUMNS:
+        codes, categories = columns[name]
+        arrays[name] = (numpy.array(codes, dtype=numpy.int32), categories)
+
+    return arrays
+
+def _number(value):
+    """
+    Returns value as int or float (Sisweb provides numbers as strings), or None
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
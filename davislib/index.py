@@ -0,0 +1,239 @@
+"""
+davislib.index
+
+This module provides an in-memory index for searching fetched courses.
+"""
+from .registrar import QueryOptions
+from .schedule_builder import GE_AREA_NAMES_BY_SB_CODE
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import re
+
+# Maps GE area names used by Registrar and ScheduleBuilder to QueryOptions.GEArea
+GE_AREAS_BY_NAME = {area.value[1]: area for area in QueryOptions.GEArea}
+GE_AREAS_BY_NAME.update({name: QueryOptions.GEArea[code]
+                         for code, name in GE_AREA_NAMES_BY_SB_CODE.items()})
+
+# Maps QueryOptions.Day to letter used in meeting days, e.g. 'MWF', 'TR'
+DAY_LETTERS = {QueryOptions.Day.MONDAY: 'M',
+               QueryOptions.Day.TUESDAY: 'T',
+               QueryOptions.Day.WEDNESDAY: 'W',
+               QueryOptions.Day.THURSDAY: 'R',
+               QueryOptions.Day.FRIDAY: 'F',
+               QueryOptions.Day.SATURDAY: 'S'}
+
+class CourseIndex(object):
+    """
+    Indexes Course objects for searches mirroring Registrar.course_query,
+    answered locally without scanning every course
+    >>> index = CourseIndex(courses)
+    >>> index.query(subject='ECS', start=14, only_open=True)
+
+    Courses are indexed as they are when added. If a course changes
+    (e.g. its seat count), build a new index.
+    """
+    def __init__(self, courses=()):
+        """
+        Parameters:
+            courses: iterable of Course
+        """
+        self._courses = list()
+
+        # Inverted indexes, mapping value to set of course ids
+        self._by_subject = defaultdict(set)
+        self._by_instructor = defaultdict(set)
+        self._by_ge_area = defaultdict(set)
+        self._by_level = defaultdict(set)
+        self._by_day = defaultdict(set)
+        self._open = set()
+
+        # Range indexes, sorted lists of tuple (value, course id)
+        self._units_low = list()
+        self._units_high = list()
+        self._starts = list() # earliest meeting start, minutes from midnight
+        self._ends = list() # latest meeting end, minutes from midnight
+        self._sorted = True
+
+        # Range values by course id, None where unknown,
+        # for filtering candidates found through other indexes
+        self._unit_ranges = list()
+        self._start_times = list()
+        self._end_times = list()
+
+        for course in courses:
+            self.add(course)
+
+    def __len__(self):
+        return len(self._courses)
+
+    def add(self, course):
+        """
+        Adds course to index
+        """
+        cid = len(self._courses)
+        self._courses.append(course)
+
+        if course.subject_code:
+            self._by_subject[course.subject_code].add(cid)
+        if course.instructor:
+            self._by_instructor[course.instructor.lower()].add(cid)
+        for area in course.ge_areas or ():
+            self._by_ge_area[GE_AREAS_BY_NAME.get(area, area)].add(cid)
+
+        level = self._level(course.number)
+        if level:
+            self._by_level[level].add(cid)
+
+        try:
+            if int(course.available_seats) > 0:
+                self._open.add(cid)
+        except (TypeError, ValueError):
+            pass
+
+        units = self._units(course.units)
+        self._unit_ranges.append(units)
+        if units:
+            self._units_low.append((units[0], cid))
+            self._units_high.append((units[1], cid))
+
+        starts, ends = list(), list()
+        for meeting in course.meetings or ():
+            for letter in meeting.days or '':
+                self._by_day[letter].add(cid)
+            if meeting.start is not None:
+                starts.append(meeting.start)
+                ends.append(meeting.end)
+        self._start_times.append(min(starts) if starts else None)
+        self._end_times.append(max(ends) if ends else None)
+        if starts:
+            self._starts.append((min(starts), cid))
+            self._ends.append((max(ends), cid))
+
+        # Range indexes are sorted once, on next query
+        self._sorted = False
+
+    def query(self, subject=None, instructor=None, ge_areas=None, level=None,
+              days=None, start=None, end=None, units=None, only_open=None):
+        """
+        Returns list of indexed Course matching all provided filters,
+        in the order they were added
+        Parameters:
+            subject: subject code, e.g. 'ECS'
+            instructor: instructor name, case insensitive
+            ge_areas: list [QueryOptions.GEArea or area name, ...]; course must satisfy all
+            level: QueryOptions.Level or its value, e.g. '001-099'
+            days: list [QueryOptions.Day, ...]; course must meet on all
+            start: earliest start time, as hour in 24-hr format
+            end: latest end time, as hour in 24-hr format
+            units: number of units; course's unit range must include it
+            only_open: boolean; course must have available seats
+        """
+        if not self._sorted:
+            for index in (self._units_low, self._units_high, self._starts, self._ends):
+                index.sort()
+            self._sorted = True
+
+        candidates = list()
+
+        if subject:
+            candidates.append(self._by_subject.get(subject, set()))
+        if instructor:
+            candidates.append(self._by_instructor.get(instructor.lower(), set()))
+        if ge_areas:
+            if isinstance(ge_areas, (QueryOptions.GEArea, str)):
+                ge_areas = [ge_areas]
+            for area in ge_areas:
+                candidates.append(self._by_ge_area.get(GE_AREAS_BY_NAME.get(area, area), set()))
+        if level:
+            candidates.append(self._by_level.get(QueryOptions.Level(level), set()))
+        if days:
+            for day in days:
+                letter = DAY_LETTERS.get(day, day)
+                candidates.append(self._by_day.get(letter, set()))
+        if only_open:
+            candidates.append(self._open)
+
+        # Range filters, as tuple (sorted index, slice of matching entries, predicate on course id)
+        ranges = list()
+        if start is not None:
+            start_minutes = start * 60
+            ranges.append((self._starts, self._at_least(self._starts, start_minutes),
+                           lambda cid: _at_least(self._start_times[cid], start_minutes)))
+        if end is not None:
+            end_minutes = end * 60
+            ranges.append((self._ends, self._at_most(self._ends, end_minutes),
+                           lambda cid: _at_most(self._end_times[cid], end_minutes)))
+        if units is not None:
+            ranges.append((self._units_low, self._at_most(self._units_low, units),
+                           lambda cid: _at_most(self._unit_range(cid, 0), units)))
+            ranges.append((self._units_high, self._at_least(self._units_high, units),
+                           lambda cid: _at_least(self._unit_range(cid, 1), units)))
+
+        if not candidates and not ranges:
+            return list(self._courses)
+
+        if candidates:
+            # Intersect smallest sets first
+            candidates.sort(key=len)
+            ids = set(candidates[0])
+            for candidate in candidates[1:]:
+                if not ids:
+                    break
+                ids &= candidate
+        else:
+            # Only the most selective range is read from its index
+            ranges.sort(key=lambda r: r[1].stop - r[1].start)
+            index, matching, _ = ranges.pop(0)
+            ids = [cid for _, cid in index[matching]]
+
+        # Remaining ranges are checked course by course
+        for _, _, predicate in ranges:
+            ids = [cid for cid in ids if predicate(cid)]
+
+        return [self._courses[cid] for cid in sorted(ids)]
+
+    def _at_least(self, index, value):
+        """
+        Returns slice of sorted index holding entries with value >= value
+        """
+        return slice(bisect_left(index, (value, -1)), len(index))
+
+    def _at_most(self, index, value):
+        """
+        Returns slice of sorted index holding entries with value <= value
+        """
+        return slice(0, bisect_right(index, (value, len(self._courses))))
+
+    def _unit_range(self, cid, bound):
+        units = self._unit_ranges[cid]
+        return units[bound] if units else None
+
+    def _level(self, number):
+        """
+        Returns QueryOptions.Level for course number, e.g. '122A', or None
+        """
+        match = re.match(r'^([0-9]+)', number or '')
+        if not match:
+            return None
+
+        number = int(match.group(1))
+        for level in QueryOptions.Level:
+            low, high = [int(n) for n in level.value.split('-')]
+            if low <= number <= high:
+                return level
+
+    def _units(self, units):
+        """
+        Returns tuple (low, high) for Course.units, or None if unknown
+        """
+        if isinstance(units, tuple):
+            return units
+        if isinstance(units, (int, float)):
+            return (units, units)
+        return None
+
+def _at_least(value, minimum):
+    return value is not None and value >= minimum
+
+def _at_most(value, maximum):
+    return value is not None and value <= maximum
@@ -0,0 +1,233 @@
+"""
+davislib.middleware
+
+This module provides middleware wrapping every request an application sends:
+rate limiting per host and retrying failed requests.
+>>> counters = RequestCounters()
+>>> reg = Registrar(middleware=default_middleware(counters))
+>>> counters.throttled, counters.retried, counters.failed
+
+A middleware is any callable middleware(send, method, url, **kwargs) returning a
+response, which may call send(method, url, **kwargs) to send the request through
+the rest of the chain.
+"""
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from urllib3.exceptions import NewConnectionError
+import datetime
+import random
+import requests
+import threading
+import time
+
+class RequestCounters(object):
+    """
+    Thread safe counts of requests affected by middleware, shared by the middleware given it.
+    Each event is counted by one middleware only.
+    """
+    def __init__(self):
+        self.throttled = 0 # requests delayed by RateLimiter, for rate or Retry-After
+        self.retried = 0 # requests sent again by Retry
+        self.failed = 0 # requests Retry gave up on, with an error or error response
+        self._lock = threading.Lock()
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def __repr__(self):
+        return '<RequestCounters throttled={} retried={} failed={}>'.format(
+            self.throttled, self.retried, self.failed)
+
+class _Bucket(object):
+    """
+    Token bucket of one host
+    """
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = now
+        self.paused_until = 0 # set by Retry-After
+
+class RateLimiter(object):
+    """
+    Limits rate of requests to each host with a token bucket,
+    and holds back requests to hosts which responded with Retry-After
+    """
+    # Requests per second to each host, unless specified
+    DEFAULT_RATE=5
+    # Status codes whose Retry-After pauses all requests to host
+    PAUSE_STATUSES=(429, 503)
+
+    def __init__(self, rate=DEFAULT_RATE, burst=None, rates=None, counters=None,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+            (optional) rate: requests per second to each host
+            (optional) burst: number of requests which may be sent at once after idling.
+                              Equal to rate if not provided.
+            (optional) rates: dictionary {host: requests per second} overriding rate,
+                              e.g. {'cas.ucdavis.edu': 1}
+            (optional) counters: RequestCounters object, counting throttled requests
+        """
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or dict()
+        self.counters = counters or RequestCounters()
+
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = dict() # {host: _Bucket}
+        self._lock = threading.Lock()
+
+    def __call__(self, send, method, url, **kwargs):
+        host = urlsplit(url).hostname
+        wait = self._reserve(host)
+        if wait > 0:
+            self.counters.increment('throttled')
+            self._sleep(wait)
+
+        r = send(method, url, **kwargs)
+
+        if r.status_code in self.PAUSE_STATUSES:
+            retry_after = parse_retry_after(r)
+            if retry_after:
+                self.pause(host, retry_after)
+        return r
+
+    def pause(self, host, seconds):
+        """
+        Holds back requests to host for seconds
+        """
+        with self._lock:
+            bucket = self._bucket(host, self._clock())
+            bucket.paused_until = max(bucket.paused_until, self._clock() + seconds)
+
+    def _reserve(self, host):
+        """
+        Takes a token from host's bucket.
+        Returns number of seconds to wait before sending.
+        """
+        with self._lock:
+            now = self._clock()
+            bucket = self._bucket(host, now)
+            bucket.tokens = min(float(bucket.burst),
+                                bucket.tokens + (now - bucket.refilled) * bucket.rate)
+            bucket.refilled = now
+
+            # Tokens go negative while requests queue, so that each waits its turn
+            bucket.tokens -= 1
+            wait = -bucket.tokens / bucket.rate if bucket.tokens < 0 else 0
+            return max(wait, bucket.paused_until - now)
+
+    def _bucket(self, host, now):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate = self.rates.get(host, self.rate)
+            burst = self.burst if self.burst is not None else max(1, rate)
+            bucket = self._buckets[host] = _Bucket(rate, burst, now)
+        return bucket
+
+class Retry(object):
+    """
+    Sends requests again after connection errors and retryable responses,
+    waiting with exponential backoff and jitter, or as long as Retry-After asks.
+    Only idempotent requests are sent again once they may have reached the server.
+    """
+    IDEMPOTENT_METHODS=('GET', 'HEAD', 'OPTIONS')
+    RETRY_STATUSES=(429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30, jitter=0.5,
+                 max_retry_after=120, counters=None, sleep=time.sleep):
+        """
+        Parameters:
+            (optional) retries: maximum number of times a request is sent again
+            (optional) backoff: seconds waited before first retry, doubled for each following
+            (optional) max_backoff: longest wait between retries, in seconds
+            (optional) jitter: fraction of each wait randomly removed,
+                               so that clients failing together do not retry together
+            (optional) max_retry_after: longest Retry-After honored, in seconds.
+                                        Responses asking for longer are returned as is.
+            (optional) counters: RequestCounters object, counting retried and failed requests
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+        self.counters = counters or RequestCounters()
+
+        self._sleep = sleep
+
+    def __call__(self, send, method, url, **kwargs):
+        idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            try:
+                r = send(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries or not (idempotent or _unsent(e)):
+                    self.counters.increment('failed')
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                if r.status_code not in self.RETRY_STATUSES:
+                    return r
+
+                retry_after = parse_retry_after(r)
+                if (not idempotent or attempt == self.retries or
+                        retry_after is not None and retry_after > self.max_retry_after):
+                    self.counters.increment('failed')
+                    return r
+
+                delay = max(self._backoff(attempt), retry_after or 0)
+                r.close()
+
+            attempt += 1
+            self.counters.increment('retried')
+            self._sleep(delay)
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random.random())
+
+def default_middleware(counters=None):
+    """
+    Returns list of middleware limiting rate and retrying, sharing counters
+    Parameters:
+        (optional) counters: RequestCounters object
+    """
+    counters = counters or RequestCounters()
+    # Retries pass through the rate limiter as well
+    return [Retry(counters=counters), RateLimiter(counters=counters)]
+
+def parse_retry_after(response):
+    """
+    Returns seconds to wait given by response's Retry-After header, or None
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def _unsent(error):
+    """
+    Returns boolean representing if error occurred before request could reach the server
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
@@ -5,10 +5,54 @@ This module contains important objects.
 """
 import requests
 import re
+import os
+import socket
+import sys
+import logging
+import threading
 import datetime
+import functools
+from collections import namedtuple
+from http.cookiejar import LWPCookieJar, LoadError
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 from bs4 import BeautifulSoup, element
+from bs4.builder import builder_registry
 from enum import Enum
 
+"""
+HTML parsing
+"""
+DEFAULT_HTML_PARSER = 'html.parser'
+_html_parser = DEFAULT_HTML_PARSER
+
+def set_html_parser(*names):
+    """
+    Selects the BeautifulSoup tree builder used to parse every page.
+    The first installed builder in names is used. If none is installed,
+    falls back to the pure-Python 'html.parser'.
+    Returns name of selected builder.
+    Parameters:
+        names: builder names in order of preference
+               e.g. set_html_parser('lxml', 'html5lib')
+    """
+    global _html_parser
+    _html_parser = next((name for name in names if builder_registry.lookup(name)),
+                        DEFAULT_HTML_PARSER)
+    return _html_parser
+
+def html_parser():
+    """
+    Returns name of selected BeautifulSoup tree builder
+    """
+    return _html_parser
+
+def parse_html(text):
+    """
+    Returns BeautifulSoup object for text, parsed by selected tree builder
+    """
+    return BeautifulSoup(text, _html_parser)
+
 """
 Data containers
 """
@@ -38,7 +82,13 @@ class Session(Enum):
 class Term(object):
     """
     Container for term information
+    Terms are immutable and interned: Term(2015, 'fall') is Term(2015, '10'),
+    so they are cheap to compare and hash, and may be used as dictionary keys.
     """
+    __slots__ = ('year', 'session', 'code', '_hash')
+    _instances = dict()
+    _instances_lock = threading.Lock()
+
     SESSION_MAPPINGS = {'fall': Session.FALL_QUARTER,
                         'fall semester': Session.FALL_SEMESTER,
                         'summer 2': Session.SUMMER_SESSION_2,
@@ -64,18 +114,41 @@ class Term(object):
                 'spring semeseter' -> spring semester
                 'winter' -> winter quarter
         """
+        # Attributes are set once, in Term.__new__
+
+    def __new__(cls, year, session):
         # Maps session string to Session object
-        session = self.SESSION_MAPPINGS.get(session, session)
-        self.session = self.Session(session)
-        self.year = int(year)
+        session = Session(cls.SESSION_MAPPINGS.get(session, session))
+        year = int(year)
 
-    @property
-    def code(self):
-        """
-        Returns term code, used by applications to identify term
-        e.g. 201510
-        """
-        return '{0}{1}'.format(self.year, self.session.value)
+        key = (cls, year, session)
+        term = cls._instances.get(key)
+        if term is not None:
+            return term
+
+        with cls._instances_lock:
+            term = cls._instances.get(key)
+            if term is None:
+                term = super(__class__, cls).__new__(cls)
+                object.__setattr__(term, 'session', session)
+                object.__setattr__(term, 'year', year)
+                #: Term code, used by applications to identify term
+                #: e.g. '201510'
+                object.__setattr__(term, 'code', '{0}{1}'.format(year, session.value))
+                object.__setattr__(term, '_hash', hash(term.code))
+                cls._instances[key] = term
+
+        return term
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Term objects are immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Term objects are immutable")
+
+    def __reduce__(self):
+        # Unpickled and copied terms are interned as well
+        return (self.__class__, (self.year, self.session.value))
 
     def __str__(self):
         return '{0} {1}'.format(self.session, self.year)
@@ -84,14 +157,120 @@ class Term(object):
         return '<Term {}>'.format(self.code)
 
     def __eq__(self, other):
-        return isinstance(other, Term) and str(self.year) == str(other.year) and self.session == other.session
+        return self is other or (isinstance(other, Term) and
+                                 self.year == other.year and self.session is other.session)
+
+    def __hash__(self):
+        return self._hash
 
 Term.Session = Session # backwards compatibility
 
+def _str(value):
+    """
+    Returns value as plain str if it is a string (e.g. a BeautifulSoup
+    NavigableString, which keeps its whole parse tree alive), else value
+    """
+    return str(value) if isinstance(value, str) else value
+
+def _intern(value):
+    """
+    Returns interned plain str if value is a string, else value
+    Used for strings repeated across many courses, e.g. subjects and locations
+    """
+    return sys.intern(str(value)) if isinstance(value, str) else value
+
+class Meeting(namedtuple('Meeting', ['days', 'start', 'end', 'location', 'type'])):
+    """
+    Container for course meeting information
+    start and end are minutes from midnight, or None if times are TBA.
+    Also readable as the dictionary formerly used for meetings, e.g.
+    meeting['times'] -> (start timedelta from midnight, end timedelta from midnight),
+    'days' in meeting, meeting.get('location'), meeting.keys(), meeting.values(),
+    meeting.items() and dict(meeting).
+    Unlike the former dictionary:
+        - a Meeting is immutable: use meeting._replace(location=...) to change a field
+        - iterating over a Meeting yields its tuple values (days, start, end, location,
+          type) rather than keys, and len(meeting) is 5; iterate over meeting.keys() instead
+        - a Meeting never equals a dictionary; compare dict(meeting) instead
+    """
+    __slots__ = ()
+    _keys = ('days', 'times', 'location', 'type')
+
+    def __new__(cls, days, start, end, location, type=None):
+        return super(__class__, cls).__new__(cls, _intern(days), start, end,
+                                             _intern(location), _intern(type))
+
+    @classmethod
+    def from_dict(cls, meeting):
+        """
+        Returns Meeting for dictionary
+        {'days': 'TR', 'times': (start timedelta, end timedelta) or None, 'location': ..., 'type': ...}
+        """
+        start = end = None
+        if meeting.get('times'):
+            start, end = [int(t.total_seconds()) // 60 for t in meeting['times']]
+        return cls(meeting.get('days'), start, end, meeting.get('location'), meeting.get('type'))
+
+    @property
+    def times(self):
+        """
+        Returns tuple (start timedelta from midnight, end timedelta from midnight)
+        or None if times are TBA
+        """
+        if self.start is None:
+            return None
+        return (datetime.timedelta(minutes=self.start), datetime.timedelta(minutes=self.end))
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self._keys:
+                raise KeyError(key)
+            return getattr(self, key)
+        return super(__class__, self).__getitem__(key)
+
+    def __contains__(self, item):
+        # String items are looked up as keys, as in the former dictionary
+        if isinstance(item, str):
+            return item in self._keys
+        return super(__class__, self).__contains__(item)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self._keys else default
+
+    def keys(self):
+        return self._keys
+
+    def values(self):
+        return tuple(getattr(self, key) for key in self._keys)
+
+    def items(self):
+        return tuple((key, getattr(self, key)) for key in self._keys)
+
+def _meetings(meetings):
+    """
+    Returns list of Meeting for list of Meeting or meeting dictionaries, or None
+    """
+    if meetings is None:
+        return None
+    return [m if isinstance(m, Meeting) else Meeting.from_dict(m) for m in meetings]
+
+def _ge_areas(areas):
+    """
+    Returns list of interned GE area names
+    """
+    return [_intern(area) for area in areas or ()]
+
 class Course(object):
     """
     Container for course information
     """
+    __slots__ = ('crn', 'term', 'name', 'number', 'section', 'title', 'units',
+                 'instructor', 'instructor_email', 'instructor_consent_required',
+                 'subject_code', 'subject', 'ge_areas', 'available_seats',
+                 'max_enrollment', 'wl_capacity', 'wl_length', 'xl_capacity',
+                 'xl_length', 'meetings', 'description', 'final_exam',
+                 'drop_time', 'prerequisites')
+
     _attrs = ['name',
             'number',
             'section',
@@ -116,7 +295,7 @@ class Course(object):
         """
         #: Course reference number
         #: e.g. 74382
-        self.crn = crn
+        self.crn = _str(crn)
 
         #: Course term object
         #: e.g. <Term 201410>
@@ -125,46 +304,46 @@ class Course(object):
         #: Course name string
         #: e.g. 'ECS 040'
 
-        self.name = attrs.get('name', None)
+        self.name = _intern(attrs.get('name', None))
 
         #: Course number
         #: e.g. '040'
-        self.number = attrs.get('number', None)
+        self.number = _intern(attrs.get('number', None))
 
         #: Section code string
         #: e.g. 'A01'
-        self.section = attrs.get('section', None)
+        self.section = _intern(attrs.get('section', None))
 
         #: Course title string
         #: e.g. 'Intro to Programming'
-        self.title = attrs.get('title', None)
+        self.title = _str(attrs.get('title', None))
 
         #: Number of units, scalar float or tuple (low, hi)
         #: e.g. 2.5 or (1.0,5.0)
-        self.units = attrs.get('units', None)
+        self.units = _str(attrs.get('units', None))
 
         #: Instructor name string
         #: e.g. 'Sean Davis'
-        self.instructor = attrs.get('instructor', None)
+        self.instructor = _intern(attrs.get('instructor', None))
 
         #: Instructor email address
         #: e.g. 'bob@ucdavis.edu'
-        self.instructor_email = attrs.get('instructor_email', None)
+        self.instructor_email = _str(attrs.get('instructor_email', None))
 
         #: Instructor consent required, boolean or None
         self.instructor_consent_required = attrs.get('instructor_consent_required', None)
 
         #: Subject code
         #: e.g. 'ECS'
-        self.subject_code = attrs.get('subject_code', SUBJECT_CODES_BY_NAME.get(attrs.get('subject')))
+        self.subject_code = _intern(attrs.get('subject_code', SUBJECT_CODES_BY_NAME.get(attrs.get('subject'))))
 
         #: Subject name string
         #: e.g. 'Engineering Computer Science'
-        self.subject = attrs.get('subject', SUBJECT_NAMES_BY_CODE.get(self.subject_code))
+        self.subject = _intern(attrs.get('subject', SUBJECT_NAMES_BY_CODE.get(self.subject_code)))
 
         #: List of GE credit satisfied
         #: e.g. ['Arts & Humanities', 'Oral Literacy']
-        self.ge_areas = attrs.get('ge_areas', list())
+        self.ge_areas = _ge_areas(attrs.get('ge_areas'))
 
         #: Number of available seats
         #: e.g. 30
@@ -186,15 +365,16 @@ class Course(object):
         #: (Sisweb only)
         self.xl_length = attrs.get('xl_length', None)
 
-        #: Meetings, as list of meetings represented as dictionaries
+        #: Meetings, as list of Meeting, also readable as dictionaries
         #: e.g. [
-        #:        {'days': 'TR', 'times': (start timedelta from midnight, end timedelta from midnight), 'location': 'Storer Hall 1322', 'type': None or 'LEC' or 'DIS'}]
+        #:        Meeting(days='TR', start=600, end=650, location='Storer Hall 1322', type=None or 'LEC' or 'DIS')
+        #:        meeting['times'] -> (start timedelta from midnight, end timedelta from midnight)
         #:        ...
         #:      ]
-        self.meetings = attrs.get('meetings', None)
+        self.meetings = _meetings(attrs.get('meetings', None))
 
         #: Course description string
-        self.description = attrs.get('description', None)
+        self.description = _str(attrs.get('description', None))
 
         #: Final exam time, as datetime.datetime object
         #: or string 'See Instructor'
@@ -202,11 +382,11 @@ class Course(object):
 
         #: Drop time string
         #: e.g. '20 Day Drop'
-        self.drop_time = attrs.get('drop_time', None)
+        self.drop_time = _intern(attrs.get('drop_time', None))
 
         #: Prerequesite string
         #: e.g. 'course 40 and 60'
-        self.prerequisites = attrs.get('prerequisites', None)
+        self.prerequisites = _str(attrs.get('prerequisites', None))
 
     def __str__(self):
         return '{}: {} -- CRN {} ({})'.format(self.name,
@@ -220,6 +400,155 @@ class Course(object):
     def __eq__(self, other):
         return isinstance(other, Course) and self.crn == other.crn and self.term == other.term
 
+class _LazyField(object):
+    """
+    Descriptor of a LazyCourse field, computed from the course's row on first
+    access and then stored in the Course slot it shadows
+    """
+    def __init__(self, name, normalize):
+        self.name = name
+        self.normalize = normalize
+        self.slot = Course.__dict__[name]
+
+    def __get__(self, course, owner=None):
+        if course is None:
+            return self
+        try:
+            return self.slot.__get__(course, owner)
+        except AttributeError:
+            pass
+
+        value = None
+        if course._fields is None or self.name in course._fields:
+            value = self.normalize(course._parsers[self.name](course._row))
+        self.slot.__set__(course, value)
+        return value
+
+    def __set__(self, course, value):
+        self.slot.__set__(course, value)
+
+    def __delete__(self, course):
+        self.slot.__delete__(course)
+
+class LazyCourse(Course):
+    """
+    Course whose expensive fields are parsed from a raw query row
+    on first access, then cached
+    >>> course = LazyCourse(crn, term, row, parsers, available_seats=row['SEATS'])
+    >>> course.meetings # parsed now
+
+    Fields provided as attrs are set immediately, like Course.
+    Fields with a parser in parsers are computed lazily.
+    If fields is provided, lazy fields not in it are never computed and read as None.
+    """
+    __slots__ = ('_row', '_parsers', '_fields')
+
+    # Fields which may be computed lazily, with the normalization Course applies to them
+    LAZY_FIELDS = {'units': _str,
+                   'instructor': _intern,
+                   'instructor_email': _str,
+                   'ge_areas': _ge_areas,
+                   'meetings': _meetings,
+                   'description': _str,
+                   'final_exam': lambda value: value,
+                   'drop_time': _intern,
+                   'prerequisites': _str}
+
+    def __init__(self, crn, term, row, parsers, fields=None, **attrs):
+        """
+        Parameters:
+            crn: five-digit course reference number
+            term: Term object
+            row: raw query row, passed to parsers
+            parsers: dictionary {field name: function(row) returning field value}
+                     for fields in LAZY_FIELDS
+            (optional) fields: collection of field names to compute; defaults to all
+            attrs: Attributes set immediately, as in Course
+        """
+        super(__class__, self).__init__(crn, term, **attrs)
+        self._row = row
+        self._parsers = parsers
+        self._fields = frozenset(fields) if fields is not None else None
+
+        for name in parsers:
+            if name not in attrs:
+                # Unset slot, so the field is computed on first access
+                delattr(self, name)
+
+for _name, _normalize in LazyCourse.LAZY_FIELDS.items():
+    setattr(LazyCourse, _name, _LazyField(_name, _normalize))
+del _name, _normalize
+
+class Grade(namedtuple('Grade', ['term', 'crn', 'letter', 'units_enrolled', 'units_completed',
+                                 'units_attempted', 'grade_points'])):
+    """
+    Container for final grade of a course
+    e.g. Grade(term=<Term 201410>, crn='40658', letter='B+', units_enrolled=4.0,
+               units_completed=4.0, units_attempted=4.0, grade_points=13.2)
+    """
+    __slots__ = ()
+
+class Transcript(object):
+    """
+    Container for final grades of every completed term
+    """
+    def __init__(self, grades, missing_terms=()):
+        """
+        Parameters:
+            grades: iterable of Grade
+            (optional) missing_terms: iterable of completed Term whose grades could not be read
+        """
+        #: List of Grade, ordered by term then CRN
+        self.grades = sorted(grades, key=lambda grade: (grade.term.code, grade.crn))
+        #: List of completed Term whose grades could not be read, and are not included
+        self.missing_terms = list(missing_terms)
+
+    def __iter__(self):
+        return iter(self.grades)
+
+    def __len__(self):
+        return len(self.grades)
+
+    def __repr__(self):
+        return '<Transcript {} grades, {} terms>'.format(len(self.grades), len(self.terms))
+
+    @property
+    def terms(self):
+        """
+        Returns list of Term with grades, in chronological order
+        """
+        terms = list()
+        for grade in self.grades:
+            if not terms or terms[-1] != grade.term:
+                terms.append(grade.term)
+        return terms
+
+    def term_grades(self, term):
+        """
+        Returns list of Grade for term
+        """
+        return [grade for grade in self.grades if grade.term == term]
+
+    @property
+    def units_completed(self):
+        return sum(grade.units_completed for grade in self.grades)
+
+    @property
+    def units_attempted(self):
+        return sum(grade.units_attempted for grade in self.grades)
+
+    @property
+    def grade_points(self):
+        return sum(grade.grade_points for grade in self.grades)
+
+    @property
+    def gpa(self):
+        """
+        Returns grade point average, or None if no graded units were attempted
+        """
+        units = self.units_attempted
+        return self.grade_points / units if units else None
+
 """
 Applications
 """
@@ -227,33 +556,170 @@ Applications
 class InvalidLoginError(Exception):
     pass
 
+class _PoolAdapter(HTTPAdapter):
+    """
+    HTTPAdapter optionally enabling TCP keepalive on pooled connections,
+    so idle connections are not silently dropped by firewalls or NAT
+    """
+    __attrs__ = HTTPAdapter.__attrs__ + ['tcp_keepalive']
+
+    def __init__(self, tcp_keepalive=None, **kwargs):
+        """
+        Parameters:
+            tcp_keepalive: idle seconds before keepalive probes are sent, or None to disable
+            kwargs: see requests.adapters.HTTPAdapter
+        """
+        self.tcp_keepalive = tcp_keepalive
+        super(__class__, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            options = list(HTTPConnection.default_socket_options)
+            options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+            for name, value in (('TCP_KEEPIDLE', self.tcp_keepalive),
+                                ('TCP_KEEPINTVL', max(1, self.tcp_keepalive // 4)),
+                                ('TCP_KEEPCNT', 4)):
+                if hasattr(socket, name): # platform dependent
+                    options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+            kwargs['socket_options'] = options
+        super(__class__, self).init_poolmanager(*args, **kwargs)
+
 class Application(object):
     """
     Base class for UC Davis web app
     """
     USER_AGENT=('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537'
                 '.36 (KHTML, like Gecko) Chrome/40.0.2214.115 Safari/537.36')
+    # Seconds for which responses from each endpoint may be cached
+    # Endpoints not listed are never cached
+    CACHE_TTLS={}
+    # Maximum number of pooled connections per host, unless specified
+    DEFAULT_POOL_MAXSIZE=10
 
-    def __init__(self, shared_app=None):
+    def __init__(self, shared_app=None, cache=None, pool_maxsize=None, tcp_keepalive=None,
+                 per_thread_sessions=False, middleware=None):
         """
         Parameters:
             (optional) shared_app: object deriving from Application
                                    whose session will be used in new object
                                    (Specify this parameter if you wish to share cookies)
+            (optional) cache: ResponseCache object storing responses of cacheable endpoints.
+                              If not provided, shared_app's cache is used.
+            (optional) pool_maxsize: maximum number of pooled connections per host.
+                                     Set it to the number of threads sending requests at once.
+            (optional) tcp_keepalive: seconds a pooled connection may idle before TCP keepalive
+                                      probes are sent. Disabled if not provided.
+            (optional) per_thread_sessions: if True, each thread sends requests through its own
+                                            requests.Session, sharing cookies and connection pools
+                                            with the application's session
+            (optional) middleware: list of middleware each request is sent through, outermost
+                                   first, e.g. davislib.middleware.default_middleware().
+                                   If not provided, shared_app's middleware is used.
         """
         super(Application, self).__init__()
 
+        self.cache = cache
+        self.middleware = list(middleware or [])
+        self._thread_sessions = None
         if shared_app:
             if isinstance(shared_app, __class__):
                 self.s = shared_app.s
+                self._thread_sessions = shared_app._thread_sessions
+                if cache is None:
+                    self.cache = shared_app.cache
+                if middleware is None:
+                    self.middleware = shared_app.middleware
+                if pool_maxsize or tcp_keepalive:
+                    self._mount_pool(pool_maxsize, tcp_keepalive)
             else:
                 raise ValueError("shared_app does not derive from Application")
         else:
             self.s = requests.Session()
             self.s.headers.update({'User-Agent': self.USER_AGENT})
+            self._mount_pool(pool_maxsize, tcp_keepalive)
+
+        if per_thread_sessions and self._thread_sessions is None:
+            self._thread_sessions = threading.local()
+
+    def session(self):
+        """
+        Returns requests.Session used by calling thread.
+        Unless per_thread_sessions was set, this is the application's session.
+        """
+        if self._thread_sessions is None:
+            return self.s
+
+        session = getattr(self._thread_sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            # CookieJar is thread safe, and pools hand out connections to one thread at a time
+            session.cookies = self.s.cookies
+            session.headers = self.s.headers
+            session.adapters = self.s.adapters
+            self._thread_sessions.session = session
+        return session
+
+    def ensure_pool_size(self, pool_maxsize):
+        """
+        Grows connection pools to hold at least pool_maxsize connections per host.
+        The pools belong to the application's session, so this also affects every
+        application sharing it (see shared_app), and they are never shrunk again.
+        Growing replaces the pools, closing their idle connections.
+        """
+        adapter = self.s.get_adapter('https://')
+        if getattr(adapter, '_pool_maxsize', 0) < pool_maxsize:
+            self._mount_pool(pool_maxsize, getattr(adapter, 'tcp_keepalive', None))
+
+    def _mount_pool(self, pool_maxsize=None, tcp_keepalive=None):
+        adapter = self.s.get_adapter('https://')
+        if pool_maxsize is None:
+            pool_maxsize = max(getattr(adapter, '_pool_maxsize', 0), self.DEFAULT_POOL_MAXSIZE)
+        if tcp_keepalive is None:
+            tcp_keepalive = getattr(adapter, 'tcp_keepalive', None)
+
+        adapter = _PoolAdapter(tcp_keepalive=tcp_keepalive, pool_maxsize=pool_maxsize)
+        self.s.mount('https://', adapter)
+        self.s.mount('http://', adapter)
 
     def request(self, method, base, endpoint, **kwargs):
-        return self.s.request(method, ''.join([base, endpoint]), **kwargs)
+        url = ''.join([base, endpoint])
+        ttl = self.cache.ttl(self, endpoint) if self.cache else None
+        if not ttl:
+            return self._send(method, url, **kwargs)
+
+        namespace = self._cache_namespace()
+        key = self.cache.key(namespace, method, url,
+                             params=kwargs.get('params'), data=kwargs.get('data'))
+        r = self.cache.get(key)
+        if r is None:
+            # Streamed responses are read in full in order to be stored
+            r = self._send(method, url, **kwargs)
+            if r.status_code == 200 and self._cacheable(r):
+                self.cache.set(key, namespace, r, ttl)
+
+        return r
+
+    def _send(self, method, url, **kwargs):
+        """
+        Sends request through middleware, then calling thread's session
+        """
+        send = self.session().request
+        for middleware in reversed(self.middleware):
+            send = functools.partial(middleware, send)
+        return send(method, url, **kwargs)
+
+    def _cache_namespace(self):
+        """
+        Returns string isolating this application's cached responses
+        from those of other users
+        """
+        return ''
+
+    def _cacheable(self, response):
+        """
+        Returns boolean representing if response may be cached
+        """
+        return True
 
     def get(self, *args, **kwargs):
         """
@@ -275,7 +741,11 @@ class ProtectedApplication(Application):
     """
     Base class for UC Davis web app relying on CAS (central authentication service)
     """
-    def __init__(self, username, password, shared_app=None):
+    # Endpoint requested to keep session alive, see ProtectedApplication.start_keepalive
+    KEEPALIVE_ENDPOINT=None
+
+    def __init__(self, username, password, shared_app=None, cache=None, cookie_dir=None,
+                 keepalive=None, **kwargs):
         """
         Parameters:
             username: kerberos login id
@@ -285,20 +755,43 @@ class ProtectedApplication(Application):
                                    if derives from ProtectedApplication,
                                    then username and password will be copied as well
                                    for re-authentication.
+            (optional) cache: see Application. Cached responses are kept
+                              separately for each username.
+            (optional) cookie_dir: directory in which each user's session cookies are saved
+                                   after logging in, and restored by later processes,
+                                   which then log in again only when CAS redirects them.
+                                   Cookie files are readable by their owner only;
+                                   files readable by other users are ignored.
+                                   If not provided, shared_app's cookie file is used.
+            (optional) keepalive: number of seconds between requests keeping session alive,
+                                  see ProtectedApplication.start_keepalive
+            (optional) pool_maxsize, tcp_keepalive, per_thread_sessions: see Application
 
         """
-        super(__class__, self).__init__(shared_app=shared_app)
+        super(__class__, self).__init__(shared_app=shared_app, cache=cache, **kwargs)
+        self.cookie_path = None
+        self._keepalive = None
 
+        # Share authentication state with shared_app,
+        # so that threads of both apps log in only once when the session expires
+        if isinstance(shared_app, __class__):
+            self.auth_service = shared_app.auth_service
         # Initialize CAS class with self as shared_app
         # this will share authentication cookies
-        if isinstance(shared_app, __class__):
-            self.auth_service = self.CAS(shared_app.username,
-                                         shared_app.password,
-                                         shared_app=self)
         if username and password:
             self.auth_service = self.CAS(username,
                                          password, shared_app=self)
 
+        if isinstance(shared_app, __class__):
+            self.cookie_path = shared_app.cookie_path
+        if cookie_dir and getattr(self, 'auth_service', None):
+            filename = re.sub(r'[^A-Za-z0-9_.-]', '_', self.auth_service.username) + '.cookies'
+            self.cookie_path = os.path.join(os.path.expanduser(cookie_dir), filename)
+            self._load_cookies()
+
+        if keepalive:
+            self.start_keepalive(keepalive)
+
     def request(self, method, base, endpoint, **kwargs):
         """
         See Application for main functionality
@@ -306,6 +799,7 @@ class ProtectedApplication(Application):
         Parameters:
             See Application.get
         """
+        generation = self._auth_generation()
         r = super(__class__, self).request(method, base, endpoint, **kwargs)
 
         if 'cas.ucdavis' not in r.url:
@@ -313,9 +807,122 @@ class ProtectedApplication(Application):
             return r
         else:
             # re-auth then send request again
-            self.auth_service.auth()
+            self._authenticate(generation)
             return super(__class__, self).request(method, base, endpoint, **kwargs)
 
+    def _auth_generation(self):
+        """
+        Returns auth_service.generation, or None if application has no credentials
+        """
+        auth_service = getattr(self, 'auth_service', None)
+        return auth_service.generation if auth_service else None
+
+    def _authenticate(self, generation=None):
+        """
+        Logs in with CAS, then persists session cookies if cookie_dir was provided
+        Parameters:
+            (optional) generation: auth_service.generation observed before the request
+                                   which was redirected to CAS. If another thread has logged
+                                   in since, the session is not renewed again.
+        """
+        if self.auth_service.reauth(generation):
+            self._save_cookies()
+
+    def start_keepalive(self, interval):
+        """
+        Starts daemon thread requesting KEEPALIVE_ENDPOINT every interval seconds,
+        so that the session does not expire while idle, and renewing it if it has.
+        Parameters:
+            interval: number of seconds between requests, shorter than session lifetime
+        """
+        if self.KEEPALIVE_ENDPOINT is None:
+            raise ValueError('{} does not support keepalive'.format(self.__class__.__name__))
+
+        self.stop_keepalive()
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._keep_alive, args=(interval, stopped),
+                                  name='davislib keepalive', daemon=True)
+        self._keepalive = (thread, stopped)
+        thread.start()
+
+    def stop_keepalive(self):
+        """
+        Stops thread started by ProtectedApplication.start_keepalive
+        """
+        if self._keepalive:
+            thread, stopped = self._keepalive
+            stopped.set()
+            self._keepalive = None
+
+    def _keep_alive(self, interval, stopped):
+        while not stopped.wait(interval):
+            try:
+                self._send_keepalive()
+            except Exception:
+                logging.exception('Keepalive request failed')
+
+    def _send_keepalive(self):
+        """
+        Requests KEEPALIVE_ENDPOINT
+        """
+        self.get(self.KEEPALIVE_ENDPOINT)
+
+    def _load_cookies(self):
+        """
+        Adds cookies saved in cookie_path to session
+        """
+        try:
+            stat = os.stat(self.cookie_path)
+        except FileNotFoundError:
+            return
+
+        if stat.st_mode & 0o077 or (hasattr(os, 'getuid') and stat.st_uid != os.getuid()):
+            logging.warning('Ignoring cookie file %s, which is accessible by other users',
+                            self.cookie_path)
+            return
+
+        jar = LWPCookieJar(self.cookie_path)
+        try:
+            # Session cookies are kept too, as CAS login state is one
+            jar.load(ignore_discard=True)
+        except (OSError, LoadError):
+            logging.exception('Could not load cookie file %s', self.cookie_path)
+            return
+
+        for cookie in jar:
+            self.s.cookies.set_cookie(cookie)
+
+    def _save_cookies(self):
+        """
+        Writes session cookies to cookie_path, readable by owner only
+        """
+        if not self.cookie_path:
+            return
+
+        jar = LWPCookieJar()
+        for cookie in self.s.cookies:
+            jar.set_cookie(cookie)
+
+        directory = os.path.dirname(self.cookie_path)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        temp_path = '{}.{}.tmp'.format(self.cookie_path, os.getpid())
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        if hasattr(os, 'fchmod'):
+            # File may have existed with other permissions
+            os.fchmod(fd, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write('#LWP-Cookies-2.0\n')
+            f.write(jar.as_lwp_str(ignore_discard=True))
+        os.replace(temp_path, self.cookie_path)
+
+    def _cache_namespace(self):
+        auth_service = getattr(self, 'auth_service', None)
+        return auth_service.username if auth_service else ''
+
+    def _cacheable(self, response):
+        # Never cache the CAS login page in place of the requested page
+        return 'cas.ucdavis' not in response.url
+
     class CAS(Application):
         BASE='https://cas.ucdavis.edu'
         LOGIN_ENDPOINT='/cas/login'
@@ -325,12 +932,42 @@ class ProtectedApplication(Application):
             self.username = username
             self.password = password
 
+            # Incremented on each login, so that threads which were
+            # redirected by the same expired session log in only once
+            self.generation = 0
+            self._lock = threading.Lock()
+
+        def reauth(self, generation=None):
+            """
+            Logs in unless another thread has done so since generation.
+            Threads calling concurrently wait for the login in progress.
+            Returns boolean representing if this call logged in.
+            """
+            with self._lock:
+                if generation is not None and self.generation != generation:
+                    return False
+                self.auth()
+                self.generation += 1
+                return True
+
         def auth(self):
             auth_page = self.get(self.LOGIN_ENDPOINT)
-            if '<div id="msg" class="success"' in auth_page.text:
+            if self._logged_in(auth_page.text):
                 return # already logged in
 
-            soup = BeautifulSoup(auth_page.text, 'html.parser')
+            action, data = self._login_form(auth_page.text)
+            r = self.post(action, data=data)
+            if not self._logged_in(r.text):
+                raise InvalidLoginError()
+
+        def _logged_in(self, text):
+            return '<div id="msg" class="success"' in text
+
+        def _login_form(self, text):
+            """
+            Returns tuple (form action, form data) for login form in text
+            """
+            soup = parse_html(text)
             login_form = soup.find("form", id="fm1")
 
             data = dict()
@@ -342,9 +979,7 @@ class ProtectedApplication(Application):
             data['username'] = self.username
             data['password'] = self.password
 
-            r = self.post(login_form['action'], data=data)
-            if '<div id="msg" class="success"' not in r.text:
-                raise InvalidLoginError()
+            return (login_form['action'], data)
 
 SUBJECT_CODES_BY_NAME = {
     'African American & African Std': 'AAS',
@@ -3,9 +3,11 @@ davislib.registrar
 
 This module provides an interface to the University Registrar
 """
-from .models import Application, Course, Term
-from bs4 import BeautifulSoup
+from .models import Application, Course, Term, parse_html, SUBJECT_CODES_BY_NAME
 from bs4.element import NavigableString
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from html.parser import HTMLParser
+import codecs
 import datetime
 import re
 from enum import Enum
@@ -26,6 +28,14 @@ class Registrar(Application):
     BASE='https://registrar.ucdavis.edu'
     COURSE_DETAIL_ENDPOINT='/courses/search/course.cfm'
     COURSE_SEARCH_ENDPOINT='/courses/search/course_search_results.cfm'
+    STREAM_CHUNK_SIZE=16384
+    # Hours of day covered by time window queries, and length of each window
+    QUERY_WINDOW_RANGE=(7, 23)
+    QUERY_WINDOW_HOURS=4
+    # Course descriptions rarely change, while search results depend on seat counts.
+    # Note that cached detail pages also hold seat counts as of when they were cached.
+    CACHE_TTLS={COURSE_DETAIL_ENDPOINT: 6 * 60 * 60,
+                COURSE_SEARCH_ENDPOINT: 5 * 60}
 
     def course_detail(self, term, crn):
         """
@@ -39,11 +49,44 @@ class Registrar(Application):
 
         r = self.get(self.COURSE_DETAIL_ENDPOINT, params=params)
 
-        course_attrs = self._parse_course(r.text, term)
-        course_attrs['term'] = term
-        course_attrs['crn'] = crn
+        return self._course_from_detail_page(r.text, term, crn)
 
-        return Course(**course_attrs)
+    def course_details(self, term, crns, max_workers=8, on_error=None):
+        """
+        Fetches details of many courses concurrently.
+        Generator yielding Course objects in order of completion.
+        Parameters:
+            term: Term object
+            crns: iterable of course reference numbers
+            max_workers: maximum number of requests in flight at once
+            on_error: optional callable on_error(crn, exception), called when
+                      fetching a single CRN fails (e.g. InvalidCrnOrTermError).
+                      Failures never stop the batch; if on_error is not provided
+                      they are logged and skipped.
+        The session's connection pools are grown to max_workers connections per host
+        and stay that size, also for applications sharing the session; see ensure_pool_size.
+        """
+        # Allow one pooled connection per worker so requests don't queue on the pool
+        self.ensure_pool_size(max_workers)
+
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(self.course_detail, term, crn): crn for crn in crns}
+            for future in as_completed(futures):
+                crn = futures[future]
+                try:
+                    course = future.result()
+                except Exception as e:
+                    if on_error:
+                        on_error(crn, e)
+                    else:
+                        logging.warning('Could not fetch CRN %s (%s): %r', crn, term, e)
+                    continue
+
+                yield course
+        finally:
+            # Don't keep fetching if the caller stops consuming early
+            executor.shutdown(wait=True, cancel_futures=True)
 
     def course_query(self, term, **kwargs):
         """
@@ -67,24 +110,113 @@ class Registrar(Application):
                 only_virtual: boolean
                 ge_areas: list [QueryOptions.GEArea, ...]
         """
+        return list(self.iter_course_query(term, **kwargs))
+
+    def planned_course_query(self, term, max_workers=8, allow_partial=False, **kwargs):
+        """
+        Queries university registrar and returns list of unique course CRNs.
+        Unlike course_query, when the registrar responds that a query must be refined,
+        the query is recursively split into narrower queries, by subject, then level,
+        then day, then time window, and the narrower queries are run concurrently.
+        Only the split by subject is known to cover every course. Splits by level, day
+        and time window miss courses above level 399, courses without listed days or
+        times, and courses not within a QUERY_WINDOW_HOURS window of QUERY_WINDOW_RANGE.
+        Raises QueryError if a query can't be split any further, or if it can only be
+        split incompletely and allow_partial is False.
+        Parameters:
+            term: Term object
+            max_workers: maximum number of requests in flight at once
+            allow_partial: if True, split by level, day and time window when needed,
+                           accepting that some courses may be missing from the result
+            kwargs: see Registrar.course_query
+        """
+        crns = set()
+        pending = [kwargs]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending:
+                futures = [(query, executor.submit(self.course_query, term, **query))
+                           for query in pending]
+                pending = list()
+                for query, future in futures:
+                    try:
+                        crns.update(future.result())
+                    except QueryError as e:
+                        pending.extend(self._refine_query(term, query, e, allow_partial))
+
+        return list(crns)
+
+    def _refine_query(self, term, query, error, allow_partial):
+        """
+        Returns list of narrower queries for query the registrar asked to refine
+        Raises error if query can't be split, or QueryError if it can only be
+        split incompletely and allow_partial is False
+        Parameters:
+            see Registrar.planned_course_query
+        """
+        subqueries, complete = self._split_query(query)
+        if not subqueries:
+            raise error
+        if not complete:
+            if not allow_partial:
+                raise QueryError('Query {} must be refined, and narrower queries '
+                                 'would not cover every course'.format(query))
+            logging.warning('Splitting query %s (%s); results may be incomplete', query, term)
+        return subqueries
+
+    def _split_query(self, query):
+        """
+        Returns tuple (list of narrower queries, boolean representing if their results
+        together are known to cover query's), or (empty list, True) if query can't be split
+        Parameters:
+            query: dictionary of Registrar.course_query kwargs
+        """
+        if not any(query.get(k) for k in ('subject', 'crn', 'name')):
+            return ([dict(query, subject=code) for code in sorted(SUBJECT_CODES_BY_NAME.values())],
+                    True)
+
+        # Levels above 399 can't be queried
+        if not query.get('level'):
+            return ([dict(query, level=level) for level in QueryOptions.Level], False)
+
+        # Courses without listed days can't be queried by day
+        if not query.get('days'):
+            return ([dict(query, days=[day]) for day in QueryOptions.Day], False)
+
+        # Courses longer than a window, or outside of QUERY_WINDOW_RANGE, are in no window
+        if not query.get('start') and not query.get('end'):
+            first, last = self.QUERY_WINDOW_RANGE
+            return ([dict(query, start=hour, end=hour + self.QUERY_WINDOW_HOURS)
+                     for hour in range(first, last - self.QUERY_WINDOW_HOURS + 1)], False)
+
+        return (list(), True)
+
+    def iter_course_query(self, term, **kwargs):
+        """
+        Queries university registrar and yields unique course CRNs
+        as they are read from the response, without loading the whole
+        results page into memory.
+        Parameters:
+            see Registrar.course_query
+        """
         if type(term) is not Term:
             raise ValueError("provided term is not an instance of Term class")
 
         query = self._map_params(term, **kwargs)
         r = self.post(self.COURSE_SEARCH_ENDPOINT,
-                      data=query)
-        soup = BeautifulSoup(r.text, 'html.parser')
+                      data=query, stream=True)
 
-        courses = list()
-        for row in soup.find_all('tr'):
-            cell = row.find('td')
-            if len(cell.contents) and 'Please refine' in cell.contents[0]:
-                raise QueryError('Registrar response: "{}"'.format(cell.string))
-            if 'onclick' in cell.attrs.keys():
-                match = re.search(r'crn=(.+?)&', cell['onclick'])
-                courses.append(match.group(1))
-
-        return list(set(courses)) # CRNs are unique
+        try:
+            parser = _CourseQueryParser()
+            decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')(errors='replace')
+            for chunk in r.iter_content(chunk_size=self.STREAM_CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                yield from parser.pop_crns()
+
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+            yield from parser.pop_crns()
+        finally:
+            r.close()
 
     def _map_params(self, term,
         crn=None,
@@ -271,13 +403,23 @@ class Registrar(Application):
             # Meeting times could not be parsed
             pass
 
+    def _course_from_detail_page(self, course_html, term, crn):
+        """
+        Returns Course object populated by parsing course detail page
+        """
+        course_attrs = self._parse_course(course_html, term)
+        course_attrs['term'] = term
+        course_attrs['crn'] = crn
+
+        return Course(**course_attrs)
+
     def _parse_course(self, course_html, term):
         if 'alert(' in course_html:
             # registrar uses alert message to indicate bad query
             raise InvalidCrnOrTermError()
             return None
 
-        soup = BeautifulSoup(course_html, 'html.parser')
+        soup = parse_html(course_html)
         attrs = dict()
 
         header = soup.find('h1')
@@ -322,6 +464,64 @@ class Registrar(Application):
 
         return attrs
 
+class _CourseQueryParser(HTMLParser):
+    """
+    Incremental parser for course search results page.
+    The first cell of each row either links to a course detail page
+    through its onclick attribute or holds the registrar's message.
+    """
+    def __init__(self):
+        super(__class__, self).__init__()
+
+        self._crns = list()
+        self._seen = set()
+        self._row_has_cell = False
+        self._in_first_cell = False
+        self._cell_text = list()
+
+    def pop_crns(self):
+        """
+        Returns list of CRNs found since last call
+        """
+        crns, self._crns = self._crns, list()
+        return crns
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'tr':
+            self._end_first_cell()
+            self._row_has_cell = False
+        elif tag == 'td':
+            self._end_first_cell()
+            if self._row_has_cell:
+                return
+
+            self._row_has_cell = True
+            self._in_first_cell = True
+            onclick = dict(attrs).get('onclick')
+            if onclick:
+                match = re.search(r'crn=(.+?)&', onclick)
+                if match and match.group(1) not in self._seen: # CRNs are unique
+                    self._seen.add(match.group(1))
+                    self._crns.append(match.group(1))
+
+    def handle_endtag(self, tag):
+        if tag in ('td', 'tr'):
+            self._end_first_cell()
+
+    def handle_data(self, data):
+        if self._in_first_cell:
+            self._cell_text.append(data)
+
+    def _end_first_cell(self):
+        if not self._in_first_cell:
+            return
+
+        self._in_first_cell = False
+        text = ''.join(self._cell_text).strip()
+        self._cell_text = list()
+        if 'Please refine' in text:
+            raise QueryError('Registrar response: "{}"'.format(text))
+
 class QueryOptions(object):
     class GEArea(Enum):
         """
@@ -3,18 +3,54 @@ davislib.schedule_builder
 
 This module provides an interface to Schedule Builder
 """
-from .models import ProtectedApplication, Course, Term
-from bs4 import BeautifulSoup
+from .models import ProtectedApplication, Course, LazyCourse, Meeting, Term
+import codecs
 import re
 import itertools
 import logging
 import json
+import random
 import requests
 import time
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 
 class RegistrationError(Exception):
-    pass
+    """
+    Raised when registration fails.
+    If raised by ScheduleBuilder.register_courses or register_courses_at, 'attempts' is
+    the list of RegistrationAttempt made, and 'attempt' the last of them.
+    """
+    attempt = None
+    attempts = ()
+
+class RegistrationAttempt(namedtuple('RegistrationAttempt', ['target', 'clock_offset', 'clock_uncertainty',
+                                                             'sent', 'received', 'error'])):
+    """
+    Timing of a registration request, in seconds since the epoch on Schedule Builder's clock
+        target: time at which registration was requested
+        clock_offset: estimated server clock minus local clock, in seconds
+        clock_uncertainty: maximum error of clock_offset in seconds, or None if unknown
+        sent: time request was sent
+        received: time response was received
+        error: registration error message, or None if registration succeeded
+    """
+    __slots__ = ()
+
+    @property
+    def lateness(self):
+        """
+        Seconds between target and sending request
+        """
+        return self.sent - self.target
+
+    @property
+    def latency(self):
+        """
+        Seconds between sending request and receiving response
+        """
+        return self.received - self.sent
 
 def term_sensitive(func):
     def visit_sb_index(self, term, *args, **kwargs):
@@ -25,6 +61,247 @@ def term_sensitive(func):
         return func(self, term, *args, **kwargs)
     return visit_sb_index
 
+class _QueryRow(object):
+    """
+    Read-only view of one row of course search results, indexing the row's
+    values by column rather than copying them into a dictionary.
+    Nested results (e.g. INSTRUCTORS, COURSEMEETINGDATA), which Schedule Builder
+    encodes as JSON strings, are decoded on first access.
+    """
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        """
+        Parameters:
+            columns: dictionary {column name: index}, shared by all rows of a result
+            values: list of row values
+        """
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        index = self._columns[key]
+        value = self._values[index]
+        if isinstance(value, str) and value.startswith('{"QUERY":'):
+            value = self._values[index] = _query_rows(json.loads(value)['QUERY'])
+        return value
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def get(self, key, default=None):
+        return self[key] if key in self._columns else default
+
+    def keys(self):
+        return self._columns.keys()
+
+    def items(self):
+        return [(key, self[key]) for key in self._columns]
+
+def _query_rows(json_obj):
+    """
+    Returns list of _QueryRow for decoded search results {'COLUMNS': [...], 'DATA': [...]}
+    """
+    columns = {name: index for index, name in enumerate(json_obj['COLUMNS'])}
+    return [_QueryRow(columns, values) for values in json_obj['DATA']]
+
+class _CourseQueryDecoder(object):
+    """
+    Incremental decoder of course search responses
+    {..., 'Results': {'COLUMNS': [...], 'DATA': [[...], ...]}, ...},
+    decoding rows of DATA as text is fed to it
+    """
+    RESULTS_KEY = '"Results"'
+    COLUMNS_KEY = '"COLUMNS"'
+    DATA_KEY = '"DATA"'
+
+    def __init__(self):
+        self.found_results = False
+        self.columns = None # {column name: index}
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._state = 'results' # results -> keys <-> data -> done
+        self._data_read = False
+        self._rows = list()
+
+    def feed(self, text):
+        self._buffer += text
+        self._decode()
+
+    def close(self):
+        if self.found_results and self._state != 'done':
+            raise ValueError('Incomplete course search results')
+
+    def pop_rows(self):
+        """
+        Returns list of _QueryRow decoded since last call
+        """
+        if self.columns is None:
+            return []
+
+        rows, self._rows = self._rows, list()
+        return [_QueryRow(self.columns, values) for values in rows]
+
+    def _decode(self):
+        buf = self._buffer
+        pos = 0
+        while True:
+            if self._state == 'results':
+                index = buf.find(self.RESULTS_KEY, pos)
+                if index < 0:
+                    # Keep enough text to match a key split across chunks
+                    pos = max(pos, len(buf) - len(self.RESULTS_KEY))
+                    break
+                pos = index + len(self.RESULTS_KEY)
+                self.found_results = True
+                self._state = 'keys'
+
+            elif self._state == 'keys':
+                columns = buf.find(self.COLUMNS_KEY, pos)
+                data = buf.find(self.DATA_KEY, pos)
+                if self.columns is None and columns >= 0 and (data < 0 or columns < data):
+                    start = buf.find('[', columns)
+                    if start < 0:
+                        break
+                    try:
+                        names, end = self._decoder.raw_decode(buf, start)
+                    except ValueError:
+                        break
+                    self.columns = {name: index for index, name in enumerate(names)}
+                    pos = end
+                    if self._data_read:
+                        self._state = 'done'
+                elif data >= 0 and (self.columns is None or columns < 0 or data < columns):
+                    start = buf.find('[', data)
+                    if start < 0:
+                        break
+                    pos = start + 1
+                    self._state = 'data'
+                else:
+                    pos = max(pos, len(buf) - len(self.COLUMNS_KEY))
+                    break
+
+            elif self._state == 'data':
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos == len(buf):
+                    break
+                if buf[pos] == ']':
+                    pos += 1
+                    self._data_read = True
+                    self._state = 'done' if self.columns is not None else 'keys'
+                    continue
+                try:
+                    values, pos = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # Row is incomplete
+                    break
+                self._rows.append(values)
+
+            else:
+                pos = len(buf)
+                break
+
+        self._buffer = buf[pos:]
+
+def _parse_units(response):
+    """
+    Returns tuple (low, high) of units
+    """
+    units_low, units_hi = float(response['UNITS_LOW']), float(response['UNITS_HIGH'])
+    if units_low > units_hi:
+        # Yes, this is an actual response case...
+        # Occurs when a course has a constant # of units.
+        # I think units_hi should equal units_low when actual units is constant.
+        units_hi = units_low
+    return (units_low, units_hi)
+
+def _primary_instructor(response):
+    """
+    Returns primary instructor row, or None if no instructor is specified
+    """
+    return next((instr for instr in response['INSTRUCTORS'] if instr['PRIMARY_IND'] == 'Y'), None)
+
+def _parse_instructor(response):
+    instructor_meta = _primary_instructor(response)
+    if instructor_meta is None:
+        return None
+    return '{} {}'.format(instructor_meta['FIRST_NAME'], instructor_meta['LAST_NAME']).strip()
+
+def _parse_instructor_email(response):
+    instructor_meta = _primary_instructor(response)
+    return instructor_meta['EMAIL'] if instructor_meta is not None else None
+
+def _parse_ge_areas(response):
+    try:
+        area_codes = filter(None, response['GE3CREDIT'].split(','))
+        return [GE_AREA_NAMES_BY_SB_CODE[area_code] for area_code in area_codes]
+    except KeyError as e:
+        logging.exception('Unrecognized GE code')
+        return list()
+
+def _parse_meetings(response):
+    meetings = list()
+    for meeting in response['COURSEMEETINGDATA']:
+        days = meeting['WEEKDAYS'].replace(',', '')
+        start = end = None
+        try:
+            start = int(meeting['BEGIN_TIME'][:2]) * 60 + int(meeting['BEGIN_TIME'][2:])
+            end = int(meeting['END_TIME'][:2]) * 60 + int(meeting['END_TIME'][2:])
+        except TypeError:
+            # times are None, indicating TBA
+            start = end = None
+
+        location = meeting['BLDG_DESC']
+        if meeting['ROOM']:
+            location += ' ' + meeting['ROOM']
+
+        meetings.append(Meeting(days, start, end, location, meeting['MEET_TYPE_DESC_SHORT']))
+
+    return meetings
+
+def _parse_final_exam(response):
+    try:
+        return datetime.strptime(response['FINALEXAMSTARTDATE'], '%B, %d %Y %H:%M:%S')
+    except TypeError:
+        # No final exam
+        return None
+
+def _parse_drop_time(response):
+    drop_time = response['ALLOWEDDROPDESC']
+    drop_days_match = re.match(r'^([0-9]+)', drop_time)
+    if drop_days_match:
+        drop_time = int(drop_days_match.group(1))
+    return drop_time
+
+def _parse_description(response):
+    description = response['DESCRIPTION']
+    if description:
+        description = description.replace('\n', ' ').replace('\r', '').strip()
+    return description
+
+def _parse_prerequisites(response):
+    prerequisites = response['PREREQUISITES']
+    return re.sub(r'\s+', ' ', prerequisites) if prerequisites else None
+
+# Parsers of Course fields which require more than reading a column,
+# computed lazily by LazyCourse
+COURSE_FIELD_PARSERS = {'units': _parse_units,
+                        'instructor': _parse_instructor,
+                        'instructor_email': _parse_instructor_email,
+                        'ge_areas': _parse_ge_areas,
+                        'meetings': _parse_meetings,
+                        'final_exam': _parse_final_exam,
+                        'drop_time': _parse_drop_time,
+                        'description': _parse_description,
+                        'prerequisites': _parse_prerequisites}
+
 class ScheduleBuilder(ProtectedApplication):
     """
     Interface to Schedule Builder
@@ -35,99 +312,63 @@ class ScheduleBuilder(ProtectedApplication):
     REMOVE_COURSE_ENDPOINT='/removeCourseFromSchedule.cfm'
     COURSE_SEARCH_ENDPOINT='/course_search/course_search_results.cfm'
     HOME_ENDPOINT='/index.cfm'
+    KEEPALIVE_ENDPOINT=HOME_ENDPOINT
+    CACHE_TTLS={COURSE_SEARCH_ENDPOINT: 60} # seat counts
+    STREAM_CHUNK_SIZE=16384
     REGISTRATION_ERRORS=['You are already enrolled or waitlisted for this course',
                          'Registration is not yet available for this term',
                          'Could not register you for this course']
+    # Errors after which registration is retried, if requested
+    RETRYABLE_REGISTRATION_ERRORS=['Registration is not yet available for this term']
+    REGISTRATION_RETRY_INTERVAL=0.1 # seconds between retries
+    REGISTRATION_RETRY_JITTER=0.05 # maximum random seconds added to or removed from interval
+    # Timing of ScheduleBuilder.register_courses_at, in seconds before target
+    REGISTRATION_PREWARM=30 # re-authenticate and estimate clock offset
+    REGISTRATION_KEEPALIVE=2 # refresh connection
+    REGISTRATION_SPIN=0.05 # busy-wait instead of sleeping
+    CLOCK_SAMPLES=4
 
     def __init__(self, *args, **kwargs):
         super(__class__, self).__init__(*args, **kwargs)
 
         self.last_term_visited = None
 
-    def _normalize_course_query_response(self, json_obj):
-        response_items = [dict(zip(json_obj['COLUMNS'], values)) for values in json_obj['DATA']]
-        for idx, item_dict in enumerate(response_items):
-            nrml_item = dict()
-            for key, value in item_dict.items():
-                if isinstance(value, str) and value.startswith('{"QUERY":'):
-                    nrml_item[key] = self._normalize_course_query_response(json.loads(value)['QUERY'])
-                else:
-                    nrml_item[key] = value
-
-            response_items[idx] = nrml_item
+    def _send_keepalive(self):
+        # Visiting the home page without a term may select another term,
+        # so revisit the term that term_sensitive methods expect to be selected
+        term = self.last_term_visited
+        if term is None:
+            self.get(self.KEEPALIVE_ENDPOINT)
+        else:
+            self.get(self.KEEPALIVE_ENDPOINT, params={'termCode': term.code})
 
-        return response_items
+    def _cacheable(self, response):
+        # Schedule Builder occasionally responds without results; such responses are retried
+        return (super(__class__, self)._cacheable(response) and
+                _CourseQueryDecoder.RESULTS_KEY.encode() in response.content)
 
     def _course_from_query_response(self, term, response):
         """
         Returns Course object populated by parsing response
         """
-        units_low, units_hi = float(response['UNITS_LOW']), float(response['UNITS_HIGH'])
-        if units_low > units_hi:
-            # Yes, this is an actual response case...
-            # Occurs when a course has a constant # of units.
-            # I think units_hi should equal units_low when actual units is constant.
-            units_hi = units_low
-
-        instructor_name = instructor_email = None
-        try:
-            instructor_meta = next(instr for instr in response['INSTRUCTORS'] if instr['PRIMARY_IND'] == 'Y')
-            instructor_name = '{} {}'.format(instructor_meta['FIRST_NAME'], instructor_meta['LAST_NAME'])
-            instructor_name = instructor_name.strip()
-            instructor_email = instructor_meta['EMAIL']
-        except StopIteration:
-            # No instructor specified
-            pass
+        attrs = {field: parse(response) for field, parse in COURSE_FIELD_PARSERS.items()}
+        return Course(**self._course_attrs_from_query_response(term, response), **attrs)
 
-        ge_areas = list()
-        try:
-            area_codes = filter(None, response['GE3CREDIT'].split(','))
-            ge_areas = [GE_AREA_NAMES_BY_SB_CODE[area_code] for area_code in area_codes]
-        except KeyError as e:
-            logging.exception('Unrecognized GE code')
-
-        meetings = list()
-        for meeting in response['COURSEMEETINGDATA']:
-            days = meeting['WEEKDAYS'].replace(',', '')
-            times = None
-            try:
-                begin_hour, begin_minutes = meeting['BEGIN_TIME'][:2], meeting['BEGIN_TIME'][2:]
-                end_hour, end_minutes = meeting['END_TIME'][:2], meeting['END_TIME'][2:]
-                begin = timedelta(hours=int(begin_hour), minutes=int(begin_minutes))
-                end = timedelta(hours=int(end_hour), minutes=int(end_minutes))
-                times = (begin, end)
-            except TypeError:
-                # times are None, indicating TBA
-                pass
-
-            location = meeting['BLDG_DESC']
-            if meeting['ROOM']:
-                location += ' ' + meeting['ROOM']
-
-            meeting = {
-                'days': days,
-                'times': times,
-                'location': location,
-                'type': meeting['MEET_TYPE_DESC_SHORT']
-            }
-            meetings.append(meeting)
-
-        final_exam = None
-        try:
-            final_exam = datetime.strptime(response['FINALEXAMSTARTDATE'], '%B, %d %Y %H:%M:%S')
-        except TypeError:
-            # No final exam
-            pass
-
-        drop_time = response['ALLOWEDDROPDESC']
-        drop_days_match = re.match(r'^([0-9]+)', drop_time)
-        if drop_days_match:
-            drop_time = int(drop_days_match.group(1))
-        if response['DESCRIPTION']:
-            response['DESCRIPTION'] = response['DESCRIPTION'].replace('\n', ' ').replace('\r', '').strip()
-        response['TITLE'] = response['TITLE'].strip()
+    def _lazy_course_from_query_response(self, term, response, fields=None):
+        """
+        Returns LazyCourse object whose expensive fields are parsed from response
+        on first access
+        Parameters:
+            (optional) fields: collection of field names to compute; other parsed fields are None
+        """
+        return LazyCourse(row=response, parsers=COURSE_FIELD_PARSERS, fields=fields,
+                          **self._course_attrs_from_query_response(term, response))
 
-        return Course(
+    def _course_attrs_from_query_response(self, term, response):
+        """
+        Returns dictionary of Course attributes read directly from response
+        """
+        return dict(
             term=term,
             crn=response['PASSEDCRN'],
             subject_code=response['SUBJECT_CODE'],
@@ -135,25 +376,19 @@ class ScheduleBuilder(ProtectedApplication):
             number=response['COURSE_NUMBER'],
             section=response['SEC'],
             title=response['TITLE'].strip(),
-            description=response['DESCRIPTION'],
             instructor_consent_required=bool(int(response['CONSENTOFINSRUCTORREQUIRED'])),
-            units=(units_low, units_hi),
-            instructor=instructor_name,
-            instructor_email=instructor_email,
-            ge_areas=ge_areas,
             available_seats=response['BLEND_SEATS_AVAIL'],
-            wl_length=response['BLEND_WAIT_COUNT'],
-            meetings=meetings,
-            final_exam=final_exam,
-            drop_time=drop_time,
-            prerequisites=re.sub(r'\s+', ' ', response['PREREQUISITES']) if response['PREREQUISITES'] else None)
+            wl_length=response['BLEND_WAIT_COUNT'])
 
-    @term_sensitive
-    def course_query(self, term, **kwargs):
+    def course_query(self, term, lazy=False, fields=None, **kwargs):
         """
         Returns list of course objects for a provided query
         Parameters:
             term: Term object
+            (optional) lazy: return LazyCourse objects, whose meetings, final exam, GE areas,
+                             instructor, etc. are parsed on first access
+            (optional) fields: collection of lazily parsed field names to compute, e.g. ['meetings'].
+                               Other lazily parsed fields are None. Implies lazy.
 
             (kwarg) course_number: course number
             (kwarg) subject: code, length 3
@@ -164,7 +399,52 @@ class ScheduleBuilder(ProtectedApplication):
             (kwarg) units: 1-12
             }
         """
-        data = {
+        return list(self.iter_course_query(term, lazy=lazy, fields=fields, **kwargs))
+
+    @term_sensitive
+    def iter_course_query(self, term, lazy=False, fields=None, **kwargs):
+        """
+        Queries Schedule Builder and yields course objects as they are
+        decoded from the response, without loading the whole response into memory.
+        Parameters:
+            see ScheduleBuilder.course_query
+        """
+        data = self._course_query_data(term, **kwargs)
+        if lazy or fields is not None:
+            make_course = lambda row: self._lazy_course_from_query_response(term, row, fields)
+        else:
+            make_course = lambda row: self._course_from_query_response(term, row)
+
+        # Schedule Builder occasionally responds without results; retry once
+        for attempt in range(2):
+            r = self.post(self.COURSE_SEARCH_ENDPOINT, data=data, stream=True)
+            try:
+                decoder = _CourseQueryDecoder()
+                text_decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')(errors='replace')
+                for chunk in r.iter_content(chunk_size=self.STREAM_CHUNK_SIZE):
+                    decoder.feed(text_decoder.decode(chunk))
+                    for row in decoder.pop_rows():
+                        yield make_course(row)
+
+                decoder.feed(text_decoder.decode(b'', final=True))
+                decoder.close()
+                for row in decoder.pop_rows():
+                    yield make_course(row)
+            finally:
+                r.close()
+
+            if decoder.found_results:
+                return
+
+        raise KeyError('Results')
+
+    def _course_query_data(self, term, **kwargs):
+        """
+        Returns course search form for query
+        Parameters:
+            see ScheduleBuilder.course_query
+        """
+        return {
             'course_number': kwargs.get('course_number', ''),
             'subject': kwargs.get('subject', ''),
             'instructor': kwargs.get('instructor', ''),
@@ -182,17 +462,6 @@ class ScheduleBuilder(ProtectedApplication):
             'termCode': term.code,
             'expandFilters': ''
         }
-        try:
-            r = self.post(self.COURSE_SEARCH_ENDPOINT, data=data)
-            results = json.loads(r.text)['Results'] # {'COLUMNS': [...], 'DATA': [[col1_data, ...], ...}
-        except KeyError:
-            r = self.post(self.COURSE_SEARCH_ENDPOINT, data=data)
-            results = json.loads(r.text)['Results']
-
-        nrml_course_responses = self._normalize_course_query_response(results)
-
-        courses = [self._course_from_query_response(term, resp) for resp in nrml_course_responses]
-        return courses
 
     def registered_courses(self, term):
         """
@@ -202,7 +471,14 @@ class ScheduleBuilder(ProtectedApplication):
         """
         params = {'termCode': term.code}
         r = self.get(self.HOME_ENDPOINT, params=params)
-        matches = re.finditer(r'CourseDetails.t(.+?).REGISTRATION_STATUS = "(Registered|Waitlisted)"', r.text)
+
+        return self._parse_registered_courses(r.text)
+
+    def _parse_registered_courses(self, text):
+        """
+        Returns list of CRNs of registered courses listed in home page
+        """
+        matches = re.finditer(r'CourseDetails.t(.+?).REGISTRATION_STATUS = "(Registered|Waitlisted)"', text)
         crns = list()
 
         for match in matches:
@@ -220,7 +496,14 @@ class ScheduleBuilder(ProtectedApplication):
         params = {'termCode': term.code}
         r = self.get(self.HOME_ENDPOINT, params=params)
 
-        match = re.search(r'PassTime1":new Date\((.+?)\),"PassTime2":new Date\((.+?)\)}', r.text)
+        return self._parse_pass_times(r.text)
+
+    def _parse_pass_times(self, text):
+        """
+        Returns pass times listed in home page
+        See ScheduleBuilder.pass_times
+        """
+        match = re.search(r'PassTime1":new Date\((.+?)\),"PassTime2":new Date\((.+?)\)}', text)
         try:
             js_args = list(zip(*[g.split(',') for g in match.groups()]))
             args = [js_args[0], # years
@@ -247,11 +530,18 @@ class ScheduleBuilder(ProtectedApplication):
         """
         params = {'termCode': term.code}
         r = self.get(self.HOME_ENDPOINT, params=params)
-        soup = BeautifulSoup(r.text, 'html.parser')
+
+        return self._parse_schedules(r.text, include_units)
+
+    def _parse_schedules(self, text, include_units):
+        """
+        Returns schedules listed in home page
+        See ScheduleBuilder.schedules
+        """
         schedules = dict()
         # Finding schedule names
         name_matches = list(re.finditer('Schedules\[Schedules\.length\] = \{"Name":"(.+?)"',
-                                   r.text))
+                                   text))
         course_re = re.compile('Schedules\[Schedules\.length \- 1\]\.SelectedList\.t'
                                '([0-9A-Z]+) =.+?"UNITS":"([0-9])"', flags=re.DOTALL)
         start = 0
@@ -263,9 +553,9 @@ class ScheduleBuilder(ProtectedApplication):
             try:
                 end = name_matches[idx + 1].start()
             except IndexError:
-                end = len(r.text)
+                end = len(text)
             course_match = None
-            for course_match in course_re.finditer(r.text, name_match.start(), end):
+            for course_match in course_re.finditer(text, name_match.start(), end):
                 crn = course_match.group(1)
                 if include_units:
                     units = int(course_match.group(2))
@@ -284,12 +574,7 @@ class ScheduleBuilder(ProtectedApplication):
             schedule: Name of schedule
             crn: course registration number of course to be added
         """
-        query = {'Term': term.code,
-                 'Schedule': schedule,
-                 'CourseID': crn,
-                 'ShowDebug': 0,
-                 '_': int(float(time.time()) * 10**3)}
-
+        query = self._schedule_change_query(term, schedule, crn)
         self.get(self.ADD_COURSE_ENDPOINT, params=query)
 
     @term_sensitive
@@ -301,15 +586,21 @@ class ScheduleBuilder(ProtectedApplication):
             schedule: Name of schedule
             crn: course registration number of course to be removed
         """
-        query = {'Term': term.code,
-                 'Schedule': schedule,
-                 'CourseID': crn,
-                 'ShowDebug': 0,
-                 '_': int(float(time.time()) * 10**3)}
-
+        query = self._schedule_change_query(term, schedule, crn)
         self.get(self.REMOVE_COURSE_ENDPOINT, params=query)
 
-    def register_schedule(self, term, schedule, allow_waitlisting=True, at=None):
+    def _schedule_change_query(self, term, schedule, crn):
+        """
+        Returns query for adding or removing course from schedule
+        """
+        return {'Term': term.code,
+                'Schedule': schedule,
+                'CourseID': crn,
+                'ShowDebug': 0,
+                '_': int(float(time.time()) * 10**3)}
+
+    def register_schedule(self, term, schedule, allow_waitlisting=True, at=None, precise=False,
+                          retry_for=0):
         """
         Registers all classes in provided schedule
         Parameters:
@@ -319,12 +610,17 @@ class ScheduleBuilder(ProtectedApplication):
                                             be placed on waitlist
             at: optional datetime object indicating future time at which registration will be executed
                     useful if you want to register at pass time
+            precise: if True and at is provided, registers with ScheduleBuilder.register_courses_at
+            retry_for: see ScheduleBuilder.register_courses
+        Returns list of RegistrationAttempt
         """
         items = self.schedules(term, include_units=True)[schedule]
-        self.register_courses(term, schedule, items, allow_waitlisting, at)
+        if precise and at:
+            return self.register_courses_at(term, schedule, items, at, allow_waitlisting, retry_for)
+        return self.register_courses(term, schedule, items, allow_waitlisting, at, retry_for)
 
     @term_sensitive
-    def register_courses(self, term, schedule, items, allow_waitlisting=True, at=None):
+    def register_courses(self, term, schedule, items, allow_waitlisting=True, at=None, retry_for=0):
         """
         Registers all classes provided in 'items'
         Parameters:
@@ -336,27 +632,182 @@ class ScheduleBuilder(ProtectedApplication):
                                             be placed on waitlist
             at: optional datetime object indicating future time at which registration will be executed
                     useful if you want to register at pass time
+            retry_for: number of seconds after first attempt during which registration is retried,
+                       every REGISTRATION_RETRY_INTERVAL +/- REGISTRATION_RETRY_JITTER seconds,
+                       while it fails with one of RETRYABLE_REGISTRATION_ERRORS
+        Returns list of RegistrationAttempt
+        Raises RegistrationError if registration fails
         """
-        crns, units = zip(*items)
-        query = {'Term': term.code,
-                 'CourseCRNs': ','.join([str(x) for x in crns]),
-                 'Schedule': schedule,
-                 'WaitlistedFlags': 'Y' if allow_waitlisting else 'N',
-                 'Units': ','.join([str(x) for x in units]),
-                 'ShowDebug': 0,
-                 '_': int(float(time.time()) * 10**3) # timestamp in milliseconds
-                 }
-
         if at:
             seconds = (at - datetime.now()).total_seconds()
             if seconds > 0:
                 time.sleep(seconds)
 
-        r = self.get(self.REGISTER_ENDPOINT, params=query)
-        # Error checking
+        return self._register(term, schedule, items, allow_waitlisting, time.time(), retry_for=retry_for)
+
+    def register_courses_at(self, term, schedule, items, at, allow_waitlisting=True, retry_for=0):
+        """
+        Registers all classes provided in 'items' as close as possible to 'at'
+        according to Schedule Builder's clock.
+        Shortly before 'at', re-authenticates, opens the connection to Schedule Builder
+        and estimates the offset of its clock from the Date headers of its responses.
+        Then sleeps, busy-waits the last moment, and sends the registration request.
+        Returns list of RegistrationAttempt.
+        Raises RegistrationError if registration fails
+        Parameters:
+            term: Term object
+            schedule: name of schedule containing courses.
+            items: list of tuple (crn, units)
+            at: datetime object, time at which to register
+            allow_waitlisting, retry_for: see ScheduleBuilder.register_courses
+        """
+        target = at.timestamp()
+
+        self._sleep_until(target - self.REGISTRATION_PREWARM)
+        self._authenticate()
+        offset, uncertainty = self._clock_offset(term)
+        self.last_term_visited = term
+
+        # Local time at which Schedule Builder's clock reads target
+        local_target = target - offset
+        if time.time() < local_target - self.REGISTRATION_KEEPALIVE:
+            # Reopen connection if it was closed since prewarming
+            self._sleep_until(local_target - self.REGISTRATION_KEEPALIVE)
+            self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+
+        self._sleep_until(local_target - self.REGISTRATION_SPIN)
+        deadline = time.perf_counter() + (local_target - time.time())
+        while time.perf_counter() < deadline:
+            pass
+
+        return self._register(term, schedule, items, allow_waitlisting, target,
+                              offset, uncertainty, retry_for)
+
+    def _register(self, term, schedule, items, allow_waitlisting, target,
+                  offset=0.0, uncertainty=None, retry_for=0):
+        """
+        Sends registration request immediately, then retries it while it fails with
+        a retryable error and retry_for seconds have not passed since the first attempt.
+        Returns list of RegistrationAttempt
+        Raises RegistrationError with attempts if registration fails
+        Parameters:
+            target: time at which registration was requested, on Schedule Builder's clock
+            offset, uncertainty: estimated Schedule Builder clock offset, see RegistrationAttempt
+        """
+        attempts = list()
+        deadline = None
+        while True:
+            query = self._registration_query(term, schedule, items, allow_waitlisting)
+            sent = time.time()
+            r = self.get(self.REGISTER_ENDPOINT, params=query)
+            received = time.time()
+
+            if deadline is None:
+                deadline = sent + retry_for
+
+            error = self._registration_error(r.text)
+            attempt = RegistrationAttempt(target, offset, uncertainty,
+                                          sent + offset, received + offset, error)
+            attempts.append(attempt)
+            if error is None:
+                return attempts
+
+            time.sleep(self._registration_retry_delay(attempts, deadline))
+
+    def _registration_retry_delay(self, attempts, deadline):
+        """
+        Returns number of seconds to wait before retrying failed registration
+        Raises RegistrationError with attempts if registration is not to be retried
+        Parameters:
+            attempts: list of RegistrationAttempt, the last of which failed
+            deadline: time after which registration is not retried
+        """
+        attempt = attempts[-1]
+        delay = self.REGISTRATION_RETRY_INTERVAL + random.uniform(-self.REGISTRATION_RETRY_JITTER,
+                                                                  self.REGISTRATION_RETRY_JITTER)
+        if attempt.error not in self.RETRYABLE_REGISTRATION_ERRORS or time.time() + delay > deadline:
+            e = RegistrationError(attempt.error)
+            e.attempt = attempt
+            e.attempts = attempts
+            raise e
+
+        logging.info('Registration attempt %d failed: %s', len(attempts), attempt.error)
+        return max(delay, 0)
+
+    def _clock_offset(self, term):
+        """
+        Returns tuple (estimated server clock minus local clock in seconds,
+        maximum error of estimate or None if unknown), from the Date headers
+        of CLOCK_SAMPLES requests
+        """
+        samples = list()
+        for sample in range(self.CLOCK_SAMPLES):
+            if sample:
+                # Spread samples across server clock's one-second resolution
+                time.sleep(1.0 / self.CLOCK_SAMPLES)
+
+            sent = time.time()
+            r = self.get(self.HOME_ENDPOINT, params={'termCode': term.code})
+            samples.append((sent, time.time(), r.headers.get('Date')))
+
+        return self._estimate_clock_offset(samples)
+
+    def _estimate_clock_offset(self, samples):
+        """
+        Returns tuple (estimated server clock minus local clock in seconds,
+        maximum error of estimate or None if unknown)
+        Parameters:
+            samples: list of tuple (local time request was sent, local time response
+                     was received, Date header of response or None)
+        """
+        low, high = float('-inf'), float('inf')
+        for sent, received, date in samples:
+            try:
+                server = parsedate_to_datetime(date).timestamp()
+            except (TypeError, ValueError):
+                continue
+
+            # Server read its clock, within [server, server + 1), between sent and received
+            low = max(low, server - received)
+            high = min(high, server + 1 - sent)
+
+        if low > high or low == float('-inf'):
+            # No usable Date headers
+            return (0.0, None)
+        return ((low + high) / 2, (high - low) / 2)
+
+    def _sleep_until(self, timestamp):
+        """
+        Sleeps until local time.time() reaches timestamp
+        """
+        seconds = timestamp - time.time()
+        while seconds > 0:
+            time.sleep(seconds)
+            seconds = timestamp - time.time()
+
+    def _registration_query(self, term, schedule, items, allow_waitlisting):
+        """
+        Returns registration query for items
+        See ScheduleBuilder.register_courses
+        """
+        crns, units = zip(*items)
+        return {'Term': term.code,
+                'CourseCRNs': ','.join([str(x) for x in crns]),
+                'Schedule': schedule,
+                'WaitlistedFlags': 'Y' if allow_waitlisting else 'N',
+                'Units': ','.join([str(x) for x in units]),
+                'ShowDebug': 0,
+                '_': int(float(time.time()) * 10**3) # timestamp in milliseconds
+                }
+
+    def _registration_error(self, text):
+        """
+        Returns error contained in registration response text, or None
+        """
         for e in self.REGISTRATION_ERRORS:
-            if e in r.text:
-                raise RegistrationError(e)
+            if e in text:
+                return e
+        return None
 
 GE_AREA_NAMES_BY_SB_CODE = {
     'AH': 'Arts & Humanities',
@@ -3,12 +3,38 @@ davislib.sisweb
 
 This moduile provides an interface to the UC Davis Student Information service
 """
-from .models import Course, ProtectedApplication, Term
-from bs4 import BeautifulSoup
+from .models import Course, Grade, ProtectedApplication, Term, Transcript, parse_html
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 import requests
 import re
+import logging
+import threading
+import time
+
+class _NavigationState(object):
+    """
+    Server-side state of a Sisweb session: which term is selected in each
+    part of Sisweb, and term lists already fetched.
+    Reset whenever Sisweb starts a new session.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self, generation=None):
+        """
+        Forgets state
+        Parameters:
+            generation: CAS login generation the new state belongs to
+        """
+        with self.lock:
+            self.generation = generation
+            self.session_expires = 0 # time after which session ID is presumed expired
+            self.course_search_term = None # term selected for course search
+            self.registration_term = None # term selected for registration pages
+            self.term_lists = dict() # {endpoint: (expiry time, list of Term)}
 
 class Sisweb(ProtectedApplication):
     """
@@ -17,6 +43,7 @@ class Sisweb(ProtectedApplication):
     """
     BASE='https://sisweb.ucdavis.edu/owa_service/owa'
     MAIN_MENU_ENDPOINT='/twbkwbis.P_GenMenu?name=bmenu.P_MainMnu'
+    KEEPALIVE_ENDPOINT=MAIN_MENU_ENDPOINT
     GRADE_TERM_SELECT_ENDPOINT='/bwskogrd.P_ViewTermGrde'
     GRADE_ENDPOINT='/bwskogrd.P_ViewGrde'
     REGISTRATION_TERM_SELECT_ENDPOINT='/bwskflib.P_SelDefTerm'
@@ -25,6 +52,31 @@ class Sisweb(ProtectedApplication):
     COURSE_LOOKUP_ENDPOINT = '/bwckgens.p_proc_term_date'
     COURSE_QUERY_ENDPOINT = '/bwskfcls.P_GetCrse'
     COURSE_SEARCH_ENDPOINT = '/bwskfcls.p_sel_crse_search'
+    CACHE_TTLS={GRADE_TERM_SELECT_ENDPOINT: 60 * 60,
+                GRADE_ENDPOINT: 24 * 60 * 60,
+                REGISTRATION_TERM_SELECT_ENDPOINT: 60 * 60,
+                COURSE_QUERY_ENDPOINT: 60} # seat counts
+    # Seconds for which parsed term lists are reused
+    TERM_LIST_TTL=60 * 60
+    # Seconds of inactivity after which Sisweb expires the session ID
+    SESSION_TTL=15 * 60
+    # Seconds before expiry at which the session ID is renewed
+    SESSION_REFRESH_MARGIN=60
+    # Immediate redirect by which Sisweb replaces any page when the session ID is expired
+    SESSION_EXPIRED_MARKER=b'<meta http-equiv="refresh" content="0;url='
+
+    def __init__(self, username, password, shared_app=None, **kwargs):
+        """
+        Parameters:
+            see ProtectedApplication
+        """
+        super(__class__, self).__init__(username, password, shared_app=shared_app, **kwargs)
+
+        if isinstance(shared_app, __class__) and shared_app.s is self.s:
+            # Same Sisweb session, same server-side state
+            self._navigation = shared_app._navigation
+        else:
+            self._navigation = _NavigationState()
 
     def request(self, method, base, endpoint, **kwargs):
         """
@@ -33,14 +85,75 @@ class Sisweb(ProtectedApplication):
         Parameters:
             see UCDavisApplication.request
         """
+        self._ensure_session()
         r = super(__class__, self).request(method, base, endpoint, **kwargs)
 
-        # Sisweb redirects to main menu when session ID is expired
-        # If the corresponding <meta> exists, fetch page again as session ID is now set. 
-        if re.search('<meta http-equiv="refresh" content="0;url=.*', r.text):
-            return super(__class__, self).request(method, base, endpoint, **kwargs)
-        else:
-            return r
+        # Sisweb redirects to main menu when session ID is expired, e.g. earlier
+        # than SESSION_TTL. If the corresponding <meta> exists, fetch page again
+        # as session ID is now set.
+        if self._session_expired(r):
+            # Terms selected in the expired session are no longer selected
+            self._navigation.reset(self._auth_generation())
+            r = super(__class__, self).request(method, base, endpoint, **kwargs)
+
+        if not getattr(r, 'from_cache', False):
+            # Sisweb extends the session ID with every page served
+            self._navigation.session_expires = time.time() + self.SESSION_TTL
+        return r
+
+    def _ensure_session(self):
+        """
+        Sets session ID by requesting main menu, if it is not set or expires
+        within SESSION_REFRESH_MARGIN seconds
+        """
+        state = self._navigation_state()
+        with state.lock:
+            if time.time() < state.session_expires - self.SESSION_REFRESH_MARGIN:
+                return
+
+            r = super(__class__, self).request('get', self.BASE, self.MAIN_MENU_ENDPOINT)
+            if self._session_expired(r) or state.generation != self._auth_generation():
+                # New session ID (or CAS login), nothing is selected in it yet
+                state.reset(self._auth_generation())
+            state.session_expires = time.time() + self.SESSION_TTL
+
+    def _navigation_state(self):
+        """
+        Returns _NavigationState of current session, reset if CAS has logged in since
+        """
+        state = self._navigation
+        with state.lock:
+            if state.generation != self._auth_generation():
+                state.reset(self._auth_generation())
+        return state
+
+    def _terms(self, endpoint):
+        """
+        Returns list of Term listed at term select endpoint,
+        reusing lists fetched within TERM_LIST_TTL seconds
+        """
+        state = self._navigation_state()
+        with state.lock:
+            expires, terms = state.term_lists.get(endpoint, (0, None))
+            if expires > time.time():
+                return list(terms)
+
+        r = self.get(endpoint)
+        terms = self._term_list(r.text)
+        with state.lock:
+            state.term_lists[endpoint] = (time.time() + self.TERM_LIST_TTL, terms)
+        return list(terms)
+
+    def _cacheable(self, response):
+        return (super(__class__, self)._cacheable(response) and
+                not self._session_expired(response))
+
+    def _session_expired(self, response):
+        """
+        Returns boolean representing if response is the page Sisweb serves
+        in place of the requested page when the session ID is expired
+        """
+        return self.SESSION_EXPIRED_MARKER in response.content
 
     def _check_term(self, term):
         if not isinstance(term, Term):
@@ -55,7 +168,7 @@ class Sisweb(ProtectedApplication):
             text: html content of term select page
             term: Term object
         """
-        soup = BeautifulSoup(text, 'html.parser')
+        soup = parse_html(text)
         term_select_ele = soup.find("select", id="term_id")
         term_options = [o['value'] for o in term_select_ele.find_all("option")]
         if term.code not in term_options:
@@ -71,7 +184,7 @@ class Sisweb(ProtectedApplication):
         Parameters:
             text: HTML page containing tag <select id="term_id">
         """
-        soup = BeautifulSoup(text, 'html.parser')
+        soup = parse_html(text)
         term_select_ele = soup.find("select", id="term_id")
         term_options = [o['value'] for o in term_select_ele.find_all("option")]
         terms = list()
@@ -83,9 +196,34 @@ class Sisweb(ProtectedApplication):
 
     def course_query(self, term, subject, 
         number=None, title=None, credit_range=('', ''), start=0, end=0, days=None):
-        self.get(self.MAIN_MENU_ENDPOINT)
-        self.get(self.COURSE_SEARCH_ENDPOINT)
+        params = self._course_query_params(term, subject, credit_range, start, end)
+        for attempt in range(2):
+            self._select_course_search_term(term)
+            r = self.post(self.COURSE_QUERY_ENDPOINT, data=params)
+            if self._navigation_state().course_search_term == term:
+                break
+            # Session was reset during query, so term was no longer selected
+
+        return self._parse_course_query(r.text, term)
+
+    def _select_course_search_term(self, term):
+        """
+        Selects term for course search, unless it is already selected in this session
+        """
+        state = self._navigation_state()
+        with state.lock:
+            if state.course_search_term == term:
+                return
+
+            self.get(self.MAIN_MENU_ENDPOINT)
+            self.get(self.COURSE_SEARCH_ENDPOINT)
+            self.post(self.COURSE_LOOKUP_ENDPOINT, data=self._course_lookup_params(term))
+            self._navigation_state().course_search_term = term
 
+    def _course_lookup_params(self, term):
+        """
+        Returns urlencoded form selecting term for course search
+        """
         params = [
             ('p_calling_proc', 'P_CrseSearch'),
             ('p_term', term.code), 
@@ -94,8 +232,12 @@ class Sisweb(ProtectedApplication):
             ('p_to_date', '')
         ]
 
-        r_lookup = self.post(self.COURSE_LOOKUP_ENDPOINT, data=urlencode(params))
+        return urlencode(params)
 
+    def _course_query_params(self, term, subject, credit_range, start, end):
+        """
+        Returns urlencoded course search form
+        """
         if start > 12:
             begin_ap = 'p'
         else:
@@ -130,9 +272,16 @@ class Sisweb(ProtectedApplication):
             ('end_mi', 0),
             ('end_ap', end_ap)]
 
-        r = self.post(self.COURSE_QUERY_ENDPOINT, data=urlencode(params))
+        return urlencode(params)
 
-        soup = BeautifulSoup(r.text, 'html.parser')
+    def _parse_course_query(self, text, term):
+        """
+        Returns list of Course listed in course search results page
+        Parameters:
+            text: html content of course search results page
+            term: Term object
+        """
+        soup = parse_html(text)
         course_table = None
         try:
             course_table = soup.find_all('table', attrs={'class': 'datadisplaytable'})[0]
@@ -193,15 +342,13 @@ class Sisweb(ProtectedApplication):
         """
         Returns list of Term for all terms in which student has enrolled
         """
-        r = self.get(self.REGISTRATION_TERM_SELECT_ENDPOINT)
-        return self._term_list(r.text)
+        return self._terms(self.REGISTRATION_TERM_SELECT_ENDPOINT)
 
     def terms_completed(self):
         """
         Returns list of Term for all terms completed by student
         """
-        r = self.get(self.GRADE_TERM_SELECT_ENDPOINT)
-        return self._term_list(r.text)
+        return self._terms(self.GRADE_TERM_SELECT_ENDPOINT)
 
     def courses_enrolled(self, term):
         """
@@ -213,17 +360,31 @@ class Sisweb(ProtectedApplication):
         self._check_term(term) 
 
         # Select Term
-        r = self.get(self.REGISTRATION_TERM_SELECT_ENDPOINT)
-        if term not in self._term_list(r.text):
+        if term not in self._terms(self.REGISTRATION_TERM_SELECT_ENDPOINT):
             raise ValueError("Invalid term: User does not have enrollment "
                              "information available for {}".format(term))
-        data = {'term_in': term.code}
-        r = self.post(self.REGISTRATION_TERM_STORE_ENDPOINT, 
-                      data=data)
+        for attempt in range(2):
+            state = self._navigation_state()
+            with state.lock:
+                if state.registration_term != term:
+                    data = {'term_in': term.code}
+                    self.post(self.REGISTRATION_TERM_STORE_ENDPOINT, 
+                              data=data)
+                    self._navigation_state().registration_term = term
+
+            # Fetch course list
+            r = self.get(self.COURSE_SCHEDULE_ENDPOINT)
+            if self._navigation_state().registration_term == term:
+                break
+            # Session was reset during request, so term was no longer selected
 
-        # Fetch course list
-        r = self.get(self.COURSE_SCHEDULE_ENDPOINT)
-        soup = BeautifulSoup(r.text, 'html.parser')
+        return self._parse_courses_enrolled(r.text)
+
+    def _parse_courses_enrolled(self, text):
+        """
+        Returns list of CRNs listed in course schedule page
+        """
+        soup = parse_html(text)
         course_tables = soup.find_all("table", 
                                       class_="datadisplaytable", 
                                       attrs={"summary": re.compile(".*course detail$")})
@@ -245,14 +406,64 @@ class Sisweb(ProtectedApplication):
         self._check_term(term)
 
         # check if grades available for provided term
-        r = self.get(self.GRADE_TERM_SELECT_ENDPOINT)
-        if term not in self._term_list(r.text):
+        if term not in self._terms(self.GRADE_TERM_SELECT_ENDPOINT):
             raise ValueError("User does not have final grades available for {}".format(term))
 
-        # fetch grades page
+        grades = self._fetch_grades(term)
+        if grades is None:
+            raise ValueError("No undergraduate grades listed for {}".format(term))
+        return grades
+
+    def _fetch_grades(self, term):
+        """
+        Returns grades for term as dictionary, see Sisweb.grades,
+        or None if grades page lists no undergraduate grades
+        """
         data = {'term_in': term.code}
         r = self.post(self.GRADE_ENDPOINT, data=data)
-        soup = BeautifulSoup(r.text, 'html.parser')
+
+        return self._parse_grades(r.text)
+
+    def transcript(self, max_workers=4):
+        """
+        Returns Transcript of final grades for all completed terms.
+        Fetches the list of completed terms once, then every term's grades concurrently.
+        Terms whose grades page lists no undergraduate grades are skipped,
+        and listed in Transcript.missing_terms.
+        Parameters:
+            max_workers: maximum number of requests in flight at once,
+                         also the size connection pools are grown to (see ensure_pool_size)
+        """
+        terms = self.terms_completed()
+        self.ensure_pool_size(max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            term_grades = list(executor.map(self._fetch_grades, terms))
+
+        return self._transcript(terms, term_grades)
+
+    def _transcript(self, terms, term_grades):
+        """
+        Returns Transcript of grades by term
+        Parameters:
+            terms: list of Term
+            term_grades: list of grades dictionary (see Sisweb.grades) or None, for each term
+        """
+        missing_terms = [term for term, grades in zip(terms, term_grades) if grades is None]
+        for term in missing_terms:
+            logging.warning('No undergraduate grades listed for %s', term)
+
+        return Transcript((Grade(term, crn, **grades)
+                           for term, grades_by_crn in zip(terms, term_grades) if grades_by_crn
+                           for crn, grades in grades_by_crn.items()),
+                          missing_terms)
+
+    def _parse_grades(self, text):
+        """
+        Returns grades listed in grades page as dictionary,
+        or None if page has no undergraduate course work table
+        """
+        soup = parse_html(text)
 
         course_table = None
         # loop until correct table is found
@@ -263,6 +474,9 @@ class Sisweb(ProtectedApplication):
                 course_table = table
                 break
 
+        if course_table is None:
+            return None
+
         # Extract grades from page
         course_header_row = course_table.find('tr')
         grades = dict()
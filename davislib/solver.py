@@ -0,0 +1,273 @@
+"""
+davislib.solver
+
+This module generates conflict-free schedules from sections of chosen courses.
+"""
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import heapq
+import itertools
+
+# Week masks have one bit per SLOT_MINUTES of each day of the week
+SLOT_MINUTES = 5
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+DAYS = 'MTWRFSU'
+DAY_MASK = (1 << SLOTS_PER_DAY) - 1
+
+FINAL_EXAM_DURATION = timedelta(hours=2)
+
+#: One valid schedule: score (lower is better) and tuple of Course, one per chosen course
+Schedule = namedtuple('Schedule', ['score', 'courses'])
+
+def week_mask(meetings):
+    """
+    Returns int whose set bits are the weekly time slots occupied by meetings.
+    Meetings whose times are TBA occupy no slots.
+    Parameters:
+        meetings: list of Meeting, or None
+    """
+    mask = 0
+    for meeting in meetings or ():
+        if meeting.start is None:
+            continue
+
+        start = meeting.start // SLOT_MINUTES
+        end = -(-meeting.end // SLOT_MINUTES) # round up
+        slots = ((1 << (end - start)) - 1) << start
+        for letter in meeting.days or '':
+            day = DAYS.find(letter)
+            if day >= 0:
+                mask |= slots << (day * SLOTS_PER_DAY)
+
+    return mask
+
+def _day_bits(mask, day):
+    return (mask >> (day * SLOTS_PER_DAY)) & DAY_MASK
+
+def days_on_campus(mask):
+    """
+    Score: number of days with at least one meeting
+    """
+    return sum(1 for day in range(len(DAYS)) if _day_bits(mask, day))
+# Adding sections never lowers the score, so partial schedules may be pruned by it
+days_on_campus.monotonic = True
+
+def _gap_slots(mask):
+    """
+    Returns week mask of free slots between first and last meeting of each day
+    """
+    free = 0
+    for day in range(len(DAYS)):
+        bits = _day_bits(mask, day)
+        if bits:
+            span = ((1 << bits.bit_length()) - 1) & ~((bits & -bits) - 1)
+            free |= (span & ~bits) << (day * SLOTS_PER_DAY)
+
+    return free
+
+def gaps(mask):
+    """
+    Score: minutes between first and last meeting of each day not spent in a meeting
+    """
+    return bin(_gap_slots(mask)).count('1') * SLOT_MINUTES
+
+def _gaps_bound(mask, reachable):
+    # Only gaps which remaining sections could occupy may be filled
+    return bin(_gap_slots(mask) & ~reachable).count('1') * SLOT_MINUTES
+gaps.bound = _gaps_bound
+
+def weighted(*terms):
+    """
+    Returns score adding up scores multiplied by weights, e.g. minutes of gaps
+    plus an hour per day on campus:
+    >>> solve(sections, score=weighted((gaps, 1), (days_on_campus, 60)))
+    Partial schedules are pruned by the weighted sum of the scores' bounds.
+    Parameters:
+        terms: tuple (score, non-negative weight) for each score.
+               Scores must never be negative.
+    """
+    def score(mask):
+        return sum(weight * term(mask) for term, weight in terms)
+
+    bounds = [(_bound(term), weight) for term, weight in terms]
+    def bound(mask, reachable):
+        # A score without bound is at least 0
+        return sum(weight * term_bound(mask, reachable)
+                   for term_bound, weight in bounds if term_bound)
+
+    score.bound = bound
+    return score
+
+def _bound(score):
+    """
+    Returns function(required mask, reachable mask) returning lower bound of score
+    of any completion of a partial schedule, or None if score provides none
+    """
+    if getattr(score, 'monotonic', False):
+        return lambda mask, reachable: score(mask)
+    return getattr(score, 'bound', None)
+
+def solve(courses, k=10, score=gaps, earliest=None, latest=None,
+          max_days=None, excluded_days=None, finals=True):
+    """
+    Returns list of up to k best Schedule, lowest score first.
+    A schedule contains exactly one section of each chosen course,
+    with no two meetings (and, if finals, no two final exams) overlapping.
+    >>> solve(sections, k=5, score=days_on_campus, earliest=9, excluded_days='F')
+    Parameters:
+        courses: iterable of Course, every candidate section of each chosen course.
+                 Sections are grouped by Course.name, e.g. 'ECS 040'.
+        (optional) k: maximum number of schedules returned
+        (optional) score: function(week mask) returning number, lower is better,
+                          e.g. gaps, days_on_campus, or a weighted combination of
+                          scores (see weighted). Partial schedules are pruned with
+                          the function's 'bound' attribute, function(mask of slots every
+                          completion occupies, mask of slots completions may occupy)
+                          returning a lower bound of the score of any completion, or with
+                          the score itself if the function has a true 'monotonic'
+                          attribute (it never decreases as sections are added).
+        (optional) earliest: earliest meeting start, as hour in 24-hr format
+        (optional) latest: latest meeting end, as hour in 24-hr format
+        (optional) max_days: maximum number of days with meetings
+        (optional) excluded_days: string of days without meetings, e.g. 'MF'
+        (optional) finals: whether final exams may not overlap
+    """
+    groups = OrderedDict()
+    for course in courses:
+        groups.setdefault(course.name, list()).append(course)
+
+    forbidden = _forbidden_mask(earliest, latest, excluded_days)
+    exams = _final_exam_masks(groups.values()) if finals else dict()
+
+    # Sections of a course with identical meeting and final exam masks are
+    # interchangeable, and searched once
+    options = list()
+    for position, sections in enumerate(groups.values()):
+        classes = OrderedDict()
+        for section in sections:
+            mask = week_mask(section.meetings)
+            if mask & forbidden:
+                continue
+            exam = exams.get(section.final_exam, (0, 0))
+            classes.setdefault((mask,) + exam, list()).append(section)
+
+        if not classes:
+            return []
+        options.append((position, [key + (tuple(alternatives),)
+                                   for key, alternatives in classes.items()]))
+
+    # Most constrained courses first
+    options.sort(key=lambda option: len(option[1]))
+
+    bound = _bound(score)
+
+    best = list() # heap of tuple (-score, -order, choices); root is worst kept schedule
+    order = itertools.count()
+    choices = [None] * len(options)
+
+    def lookahead(depth, mask, exam_bits):
+        """
+        Returns tuple (mask extended by slots every completion occupies,
+        slots completions may occupy), or None if some course has no compatible section
+        """
+        required, reachable = mask, 0
+        for _, classes in options[depth:]:
+            common, union = -1, 0
+            for section_mask, _, exam_conflicts, _ in classes:
+                if not section_mask & mask and not exam_conflicts & exam_bits:
+                    common &= section_mask
+                    union |= section_mask
+            if common == -1:
+                return None
+            required |= common
+            reachable |= union
+
+        return required, reachable
+
+    def search(depth, mask, exam_bits):
+        if depth == len(options):
+            value = score(mask)
+            entry = (-value, -next(order), tuple(choices))
+            if len(best) < k:
+                heapq.heappush(best, entry)
+            elif value < -best[0][0]:
+                heapq.heapreplace(best, entry)
+            return
+
+        position, classes = options[depth]
+        candidates = list()
+        for section_mask, exam_bit, exam_conflicts, alternatives in classes:
+            if section_mask & mask or exam_conflicts & exam_bits:
+                continue
+
+            next_mask, next_exam_bits = mask | section_mask, exam_bits | exam_bit
+            ahead = lookahead(depth + 1, next_mask, next_exam_bits)
+            if ahead is None:
+                continue
+            required, reachable = ahead
+            if max_days is not None and days_on_campus(required) > max_days:
+                continue
+
+            estimate = bound(required, reachable) if bound else 0
+            if len(best) == k and estimate >= -best[0][0]:
+                continue
+            candidates.append((estimate, next_mask, next_exam_bits, alternatives))
+
+        # Search most promising sections first, so worse ones are pruned sooner
+        candidates.sort(key=lambda candidate: candidate[0])
+        for estimate, next_mask, next_exam_bits, alternatives in candidates:
+            if len(best) == k and estimate >= -best[0][0]:
+                break
+            choices[depth] = (position, alternatives)
+            search(depth + 1, next_mask, next_exam_bits)
+
+    if k > 0:
+        search(0, 0, 0)
+
+    # Expand interchangeable sections, best schedules first
+    schedules = list()
+    for negative_score, _, chosen in sorted(best, reverse=True):
+        alternatives = [sections for _, sections in sorted(chosen, key=lambda c: c[0])]
+        for sections in itertools.product(*alternatives):
+            if len(schedules) == k:
+                return schedules
+            schedules.append(Schedule(-negative_score, sections))
+
+    return schedules
+
+def _forbidden_mask(earliest, latest, excluded_days):
+    """
+    Returns week mask of slots in which no meeting may occur
+    """
+    day = 0
+    if earliest is not None:
+        day |= (1 << (earliest * 60 // SLOT_MINUTES)) - 1
+    if latest is not None:
+        day |= DAY_MASK & ~((1 << (latest * 60 // SLOT_MINUTES)) - 1)
+
+    mask = 0
+    for index, letter in enumerate(DAYS):
+        if excluded_days and letter in excluded_days:
+            mask |= DAY_MASK << (index * SLOTS_PER_DAY)
+        else:
+            mask |= day << (index * SLOTS_PER_DAY)
+
+    return mask
+
+def _final_exam_masks(groups):
+    """
+    Returns dictionary {final exam datetime: tuple (bit, mask of overlapping exams' bits)}
+    for final exams of sections in groups
+    """
+    exams = sorted({section.final_exam for sections in groups for section in sections
+                    if isinstance(section.final_exam, datetime)})
+
+    masks = dict()
+    for index, exam in enumerate(exams):
+        conflicts = 0
+        for other_index, other in enumerate(exams):
+            if abs(exam - other) < FINAL_EXAM_DURATION:
+                conflicts |= 1 << other_index
+        masks[exam] = (1 << index, conflicts)
+
+    return masks
@@ -0,0 +1,183 @@
+"""
+davislib.watcher
+
+This module provides a service watching many sections for seat availability changes.
+"""
+from .registrar import Registrar
+from collections import namedtuple
+import logging
+import time
+
+#: Emitted when a watched section's available seats or waitlist length changes.
+#: course is a LazyCourse computing only SeatWatcher.COURSE_FIELDS of its lazily parsed fields
+SeatChange = namedtuple('SeatChange', ['term', 'crn',
+                                       'available_seats', 'wl_length',
+                                       'previous_available_seats', 'previous_wl_length',
+                                       'course'])
+
+class _Group(object):
+    """
+    Watched sections of one subject in one term, polled with a single search
+    """
+    def __init__(self, term, subject, interval, now):
+        self.term = term
+        self.subject = subject
+        self.crns = set()
+        self.seats = dict() # {crn: (available_seats, wl_length)} last observed
+        self.interval = interval
+        self.next_poll = now
+
+class SeatWatcher(object):
+    """
+    Watches sections for changes in available seats and waitlist length.
+    Watched sections are grouped by term and subject, so that one
+    ScheduleBuilder.course_query covers every watched section of a subject.
+    Subjects whose sections change are polled more often, down to min_interval,
+    and quiet subjects less often, up to max_interval. All polling shares
+    a budget of max_requests_per_minute.
+    >>> watcher = SeatWatcher(ScheduleBuilder(username, password))
+    >>> watcher.watch(term, '74382')
+    >>> for change in watcher.run():
+    ...     print(change.crn, change.available_seats)
+    """
+    # Lazily parsed course fields computed for polled sections, see ScheduleBuilder.course_query.
+    # Seat counts are read directly from search results.
+    COURSE_FIELDS=()
+
+    def __init__(self, schedule_builder, registrar=None, max_requests_per_minute=30,
+                 min_interval=15, max_interval=600, backoff=1.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+            schedule_builder: ScheduleBuilder object used to poll seat counts
+            (optional) registrar: Registrar object used to look up subjects of sections
+                                  watched without one
+            (optional) max_requests_per_minute: global polling budget
+            (optional) min_interval: shortest time between polls of a subject, in seconds
+            (optional) max_interval: longest time between polls of a subject, in seconds
+            (optional) backoff: factor by which a quiet subject's interval grows after each poll
+        """
+        self.schedule_builder = schedule_builder
+        self.registrar = registrar or Registrar()
+        self.max_requests_per_minute = max_requests_per_minute
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+
+        self._clock = clock
+        self._sleep = sleep
+        self._groups = dict() # {(term, subject): _Group}
+        self._tokens = float(max_requests_per_minute)
+        self._refilled = clock()
+
+    def watch(self, term, crn, subject=None):
+        """
+        Starts watching section
+        Parameters:
+            term: Term object
+            crn: course reference number
+            (optional) subject: subject code of section, e.g. 'ECS'.
+                                If not provided, it is looked up through the registrar.
+        """
+        crn = str(crn)
+        if subject is None:
+            subject = self.registrar.course_detail(term, crn).subject_code
+
+        key = (term, subject)
+        if key not in self._groups:
+            self._groups[key] = _Group(term, subject, self.min_interval, self._clock())
+        self._groups[key].crns.add(crn)
+
+    def unwatch(self, term, crn):
+        """
+        Stops watching section
+        """
+        crn = str(crn)
+        for key, group in list(self._groups.items()):
+            if group.term == term and crn in group.crns:
+                group.crns.discard(crn)
+                group.seats.pop(crn, None)
+                if not group.crns:
+                    del self._groups[key]
+
+    def poll(self):
+        """
+        Polls the most overdue subject, if one is due and the budget allows.
+        Returns list of SeatChange for its sections.
+        """
+        now = self._clock()
+        self._refill(now)
+        due = [g for g in self._groups.values() if g.next_poll <= now]
+        if not due or self._tokens < 1:
+            return []
+
+        group = min(due, key=lambda g: g.next_poll)
+        self._tokens -= 1
+
+        try:
+            courses = self.schedule_builder.course_query(group.term, subject=group.subject,
+                                                         lazy=True, fields=self.COURSE_FIELDS)
+        except Exception as e:
+            logging.warning('Could not poll %s (%s): %r', group.subject, group.term, e)
+            # A failed poll says nothing about the subject's activity, so the interval is kept
+            group.next_poll = self._clock() + group.interval
+            return []
+
+        changes = list()
+        for course in courses:
+            crn = str(course.crn)
+            if crn not in group.crns:
+                continue
+
+            seats = (course.available_seats, course.wl_length)
+            previous = group.seats.get(crn)
+            group.seats[crn] = seats
+            if previous is not None and previous != seats:
+                changes.append(SeatChange(group.term, crn, seats[0], seats[1],
+                                          previous[0], previous[1], course))
+
+        # Poll active subjects more often, quiet ones less often
+        if changes:
+            group.interval = max(self.min_interval, group.interval / self.backoff)
+        else:
+            group.interval = min(self.max_interval, group.interval * self.backoff)
+        group.next_poll = self._clock() + group.interval
+
+        return changes
+
+    def run(self, duration=None):
+        """
+        Generator polling watched sections and yielding SeatChange as they are observed
+        Parameters:
+            (optional) duration: number of seconds after which to stop. Runs forever if not provided.
+        """
+        deadline = None if duration is None else self._clock() + duration
+        while deadline is None or self._clock() < deadline:
+            changes = self.poll()
+            for change in changes:
+                yield change
+
+            wait = self._wait()
+            if deadline is not None:
+                wait = min(wait, deadline - self._clock())
+            if wait > 0:
+                self._sleep(wait)
+
+    def _refill(self, now):
+        rate = self.max_requests_per_minute / 60.0
+        self._tokens = min(float(self.max_requests_per_minute),
+                           self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+    def _wait(self):
+        """
+        Returns number of seconds until next poll may occur
+        """
+        if not self._groups:
+            return self.min_interval
+
+        now = self._clock()
+        self._refill(now)
+        due_in = min(g.next_poll for g in self._groups.values()) - now
+        budget_in = (1 - self._tokens) * 60.0 / self.max_requests_per_minute
+        return max(due_in, budget_in, 0)
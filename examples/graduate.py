@@ -143,7 +143,7 @@ def fix_conflicts(area_credit, flagged):
                     min_ = area
             area_credit[min_] += course.units
 
-def add_term_credit(area_credit, flagged, sw, reg, term):
+def add_term_credit(area_credit, flagged, reg, term, term_grades):
     """
     Iterating through each course completed in term, 
     compiles and adds accumulated GE credit to area_credit.
@@ -158,27 +158,26 @@ def add_term_credit(area_credit, flagged, sw, reg, term):
         flagged: dictionary containing conflicting courses by GE category
                      i.e. {'Topical Breadth': [<Course>, ...], 
                            'Core Literacies': []}
-        sw: Sisweb object
         reg: Registrar object
         term: Term object
+        term_grades: list of Grade for term
     """
-    term_grades = sw.grades(term)
+    completed = {grade.crn: grade for grade in term_grades if grade.units_completed > 0}
 
-    for (crn, grades) in term_grades.items():
-        if grades['units_completed'] > 0:
-            course = reg.course_detail(term, crn)
-            cat_conflicts = category_conflicts(course)
-            for cat in cat_conflicts:
-                flagged[cat].append(course)
+    for course in reg.course_details(term, completed):
+        grade = completed[course.crn]
+        cat_conflicts = category_conflicts(course)
+        for cat in cat_conflicts:
+            flagged[cat].append(course)
 
-            for area in course.ge_areas:
-                if area in area_credit.keys():
-                    conflict_area_nested = [GE_AREAS[cat] for cat in cat_conflicts]
-                    conflict_areas = itertools.chain.from_iterable(conflict_area_nested)
+        for area in course.ge_areas:
+            if area in area_credit.keys():
+                conflict_area_nested = [GE_AREAS[cat] for cat in cat_conflicts]
+                conflict_areas = itertools.chain.from_iterable(conflict_area_nested)
 
-                    if area in conflict_areas:
-                        continue
-                    area_credit[area] += float(grades['units_completed'])
+                if area in conflict_areas:
+                    continue
+                area_credit[area] += float(grade.units_completed)
 
 def main():
     username = input("Enter kerberos username: ")
@@ -188,12 +187,12 @@ def main():
     sw = Sisweb(username, password)
     reg = Registrar()
 
-    terms = sw.terms_completed()
+    transcript = sw.transcript()
     area_credit = dict.fromkeys(AREA_MINIMUMS.keys(), 0.0)
     flagged = dict.fromkeys(GE_AREAS.keys(), list())
 
-    for term in terms:
-        add_term_credit(area_credit, flagged, sw, reg, term)
+    for term in transcript.terms:
+        add_term_credit(area_credit, flagged, reg, term, transcript.term_grades(term))
 
     fix_conflicts(area_credit, flagged)
     print_results(area_credit)
@@ -1,9 +1,13 @@
 from davislib import Term, ScheduleBuilder
+from davislib.schedule_builder import RegistrationError
 from datetime import datetime, timedelta
 import sys
 from getpass import getpass
 from os.path import expanduser
 
+# Seconds during which registration is retried while it is not yet available
+RETRY_SECONDS = 10
+
 def print_help():
 	print('Example usage: python3 register.py 2015 fall "Schedule 1" --delay 2')
 	print()
@@ -29,9 +33,11 @@ def print_help():
 	print()
 	print('schedule: name of schedule')
 	print()
-	print('--delay n: Optional number of seconds to delay registration after pass time. Default is 3 to account for discrepencies in time syncronization. ')
+	print('--delay n: Optional number of seconds to delay registration after pass time. Default is 0; registration is timed by Schedule Builder\'s clock. ')
 	print()
 	print('--now: If provided, immediately attempts to register courses instead of waiting until pass time + delay. ')
+	print()
+	print('If registration is not yet available, it is retried for {} seconds.'.format(RETRY_SECONDS))
 
 def main():
 	if len(sys.argv) < 4:
@@ -80,8 +86,19 @@ def main():
 			reg_time = pass_times[0]
 
 	print('Registering in {0:.2f} seconds...'.format((reg_time - now).total_seconds()))
-	sb.register_schedule(term, schedule, at=reg_time)
+	try:
+		attempts = sb.register_schedule(term, schedule, at=reg_time, precise=reg_time > now,
+		                                retry_for=RETRY_SECONDS)
+	except RegistrationError as e:
+		print_attempts(e.attempts)
+		raise
+	print_attempts(attempts)
 	print('Registered')
 
+def print_attempts(attempts):
+	for attempt in attempts:
+		print('Sent {0:+.3f}s from pass time (server clock offset {1:+.3f}s), response in {2:.3f}s: {3}'.format(
+			attempt.lateness, attempt.clock_offset, attempt.latency, attempt.error or 'OK'))
+
 if __name__ == '__main__':
 	main()
\ No newline at end of file
@@ -16,6 +16,9 @@ setup(name='davislib',
       author_email='achaden@ucdavis.edu',
       url='https://github.com/andyh2',
       install_requires=install_requires,
+      extras_require={'async': ['aiohttp'],
+                      'lxml': ['lxml'],
+                      'numpy': ['numpy']},
       packages=['davislib'],
       zip_safe=False
      )
\ No newline at end of file
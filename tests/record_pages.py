@@ -0,0 +1,87 @@
+"""
+Records pages checked by test_html_parser.py into tests/pages.
+
+Usage:
+    python tests/record_pages.py registrar YEAR SESSION CRN [CRN ...]
+        Records course detail page of each CRN, e.g. registrar 2015 fall 12345
+    python tests/record_pages.py sisweb YEAR SESSION SUBJECT
+        Logs in, and records term select, final grades, course schedule and
+        course search for SUBJECT in term
+
+Recorded pages are scrubbed of the student's name and ID (Sisweb's static
+header) and of the username; pass --scrub TEXT to remove any other text.
+Read pages before checking them in.
+"""
+from davislib import Registrar, Sisweb, Term
+from getpass import getpass
+import os
+import re
+import sys
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'pages')
+
+def scrub(text, secrets):
+    """
+    Returns text without Sisweb's static header, which lists the student's ID and name,
+    and with each string in secrets replaced
+    """
+    text = re.sub(r'(?is)(<div class="staticheaders">).*?(</div>)', r'\1\n\2', text)
+    for secret in secrets:
+        text = re.sub(re.escape(secret), 'XXXXX', text, flags=re.IGNORECASE)
+    return text
+
+def write(site, name, text, secrets):
+    path = os.path.join(PAGES_DIR, site, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(scrub(text, secrets))
+    print('Wrote {}'.format(path))
+
+def record_registrar(term, crns, secrets):
+    reg = Registrar()
+    for crn in crns:
+        r = reg.get(reg.COURSE_DETAIL_ENDPOINT, params={'crn': crn, 'termCode': term.code})
+        write('registrar', 'course_detail_recorded_{}_{}.html'.format(term.code, crn),
+              r.text, secrets)
+
+def record_sisweb(term, subject, secrets):
+    username = input('Enter kerberos username: ')
+    password = getpass('Enter kerberos password: ')
+    secrets = [username] + secrets
+    sw = Sisweb(username, password)
+
+    r = sw.get(sw.GRADE_TERM_SELECT_ENDPOINT)
+    write('sisweb', 'term_select_recorded_grades.html', r.text, secrets)
+
+    r = sw.post(sw.GRADE_ENDPOINT, data={'term_in': term.code})
+    write('sisweb', 'grades_recorded_{}.html'.format(term.code), r.text, secrets)
+
+    sw.post(sw.REGISTRATION_TERM_STORE_ENDPOINT, data={'term_in': term.code})
+    r = sw.get(sw.COURSE_SCHEDULE_ENDPOINT)
+    write('sisweb', 'course_schedule_recorded_{}.html'.format(term.code), r.text, secrets)
+
+    sw._select_course_search_term(term)
+    r = sw.post(sw.COURSE_QUERY_ENDPOINT,
+                data=sw._course_query_params(term, subject, ('', ''), 0, 0))
+    write('sisweb', 'course_search_recorded_{}_{}.html'.format(subject.lower(), term.code),
+          r.text, secrets)
+
+def main():
+    args = sys.argv[1:]
+    secrets = list()
+    while '--scrub' in args:
+        index = args.index('--scrub')
+        secrets.append(args[index + 1])
+        del args[index:index + 2]
+
+    if len(args) < 4 or args[0] not in ('registrar', 'sisweb'):
+        sys.exit(__doc__)
+
+    site, year, session = args[:3]
+    term = Term(int(year), session)
+    if site == 'registrar':
+        record_registrar(term, args[3:], secrets)
+    else:
+        record_sisweb(term, args[3], secrets)
+
+if __name__ == '__main__':
+    main()
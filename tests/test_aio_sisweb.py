@@ -0,0 +1,116 @@
+"""
+Checks that AsyncSisweb keeps term selections, term lists and the session ID
+between calls, as Sisweb does.
+"""
+from davislib import Term
+from davislib.sisweb import Sisweb
+import asyncio
+import contextlib
+import unittest
+
+try:
+    from davislib.aio import AsyncSisweb
+except ImportError:
+    AsyncSisweb = None
+
+TERM = Term(2015, 'fall')
+
+EXPIRED_PAGE = (b'<html><head><meta http-equiv="refresh" '
+                b'content="0;url=/owa_service/owa/twbkwbis.P_GenMenu?name=bmenu.P_MainMnu">'
+                b'</head></html>')
+TERM_SELECT_PAGE = (b'<html><body><select id="term_id">'
+                    b'<option value="201510">Fall Quarter 2015</option>'
+                    b'<option value="201503">Spring Quarter 2015</option>'
+                    b'</select></body></html>')
+COURSE_QUERY_PAGE = (b'<html><body><table class="datadisplaytable">'
+                     b'<tr><th>Engineering Computer Science</th></tr>'
+                     b'<tr><th>CRN</th><th>Subj</th><th>Crse</th><th>Rem</th></tr>'
+                     b'<tr><td class="dddefault">12345</td><td class="dddefault">ECS</td>'
+                     b'<td class="dddefault">060</td><td class="dddefault">3</td></tr>'
+                     b'</table></body></html>')
+
+class FakeResponse(object):
+    def __init__(self, url, body):
+        self.url = url
+        self.status = 200
+        self.headers = dict()
+        self._body = body
+
+    async def read(self):
+        return self._body
+
+    async def text(self, errors='strict'):
+        return self._body.decode('utf-8', errors)
+
+class FakeSession(object):
+    """
+    aiohttp.ClientSession answering from pages, recording (method, endpoint) of each request
+    """
+    closed = False
+
+    def __init__(self):
+        self.requests = list()
+        self.expire_next = False
+
+    @contextlib.asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        endpoint = url[len(Sisweb.BASE):]
+        self.requests.append((method, endpoint.split('?')[0]))
+        if self.expire_next:
+            self.expire_next = False
+            body = EXPIRED_PAGE
+        elif endpoint.startswith((Sisweb.GRADE_TERM_SELECT_ENDPOINT,
+                                  Sisweb.REGISTRATION_TERM_SELECT_ENDPOINT)):
+            body = TERM_SELECT_PAGE
+        elif endpoint.startswith(Sisweb.COURSE_QUERY_ENDPOINT):
+            body = COURSE_QUERY_PAGE
+        else:
+            body = b'<html><body></body></html>'
+        yield FakeResponse(url, body)
+
+    async def close(self):
+        pass
+
+@unittest.skipIf(AsyncSisweb is None, 'aiohttp is not installed')
+class TestAsyncSiswebNavigation(unittest.TestCase):
+    def setUp(self):
+        self.sw = AsyncSisweb(None, None)
+        self.session = self.sw.s.session = FakeSession()
+
+    def count(self, method, endpoint):
+        return self.session.requests.count((method, endpoint.split('?')[0]))
+
+    def test_term_selected_once(self):
+        async def run():
+            first = await self.sw.course_query(TERM, 'ECS')
+            second = await self.sw.course_query(TERM, 'ECS')
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual([course.crn for course in first], ['12345'])
+        self.assertEqual([course.crn for course in second], ['12345'])
+        self.assertEqual(self.count('POST', Sisweb.COURSE_LOOKUP_ENDPOINT), 1)
+        self.assertEqual(self.count('POST', Sisweb.COURSE_QUERY_ENDPOINT), 2)
+        # Session ID set once, then reused
+        self.assertEqual(self.count('GET', Sisweb.MAIN_MENU_ENDPOINT), 2)
+
+    def test_expired_session_selects_term_again(self):
+        async def run():
+            await self.sw.course_query(TERM, 'ECS')
+            self.session.expire_next = True
+            return await self.sw.course_query(TERM, 'ECS')
+
+        courses = asyncio.run(run())
+        self.assertEqual([course.crn for course in courses], ['12345'])
+        self.assertEqual(self.count('POST', Sisweb.COURSE_LOOKUP_ENDPOINT), 2)
+
+    def test_term_list_reused(self):
+        async def run():
+            await self.sw.terms_completed()
+            return await self.sw.terms_completed()
+
+        self.assertEqual(asyncio.run(run()), [Term(2015, 'fall'), Term(2015, 'spring')])
+        self.assertEqual(self.count('GET', Sisweb.GRADE_TERM_SELECT_ENDPOINT), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+Checks that Catalog.build never replaces a snapshot with an incomplete one
+unless allow_partial is set.
+"""
+from davislib import Course, Registrar, Term
+from davislib.catalog import Catalog
+from davislib.registrar import InvalidCrnOrTermError, QueryError
+import unittest
+
+TERM = Term(2015, 'fall')
+
+class FakeRegistrar(Registrar):
+    """
+    Registrar answering from memory, failing to fetch details of CRNs in failing
+    """
+    def __init__(self, crns, failing=()):
+        super(__class__, self).__init__()
+        self.crns = crns
+        self.failing = set(failing)
+
+    def planned_course_query(self, term, max_workers=8, allow_partial=False, **kwargs):
+        return list(self.crns)
+
+    def course_detail(self, term, crn):
+        if crn in self.failing:
+            raise InvalidCrnOrTermError()
+        return Course(crn, term, name='ECS 0{}'.format(crn[-2:]), subject_code='ECS',
+                      available_seats=3, max_enrollment=30, meetings=[], ge_areas=[])
+
+class TestCatalogBuild(unittest.TestCase):
+    def catalog(self, registrar):
+        catalog = Catalog(':memory:', registrar=registrar)
+        self.addCleanup(catalog.close)
+        return catalog
+
+    def test_build(self):
+        catalog = self.catalog(FakeRegistrar(['10001', '10002', '10003']))
+        self.assertEqual(catalog.build(TERM), 3)
+        self.assertEqual([course.crn for course in catalog.courses(TERM)],
+                         ['10001', '10002', '10003'])
+        self.assertEqual(catalog.terms(), [TERM])
+
+    def test_failed_detail_keeps_snapshot(self):
+        registrar = FakeRegistrar(['10001', '10002', '10003'])
+        catalog = self.catalog(registrar)
+        catalog.build(TERM)
+
+        registrar.failing = {'10002'}
+        with self.assertLogs(level='WARNING'):
+            with self.assertRaisesRegex(QueryError, '10002'):
+                catalog.build(TERM)
+        self.assertEqual([course.crn for course in catalog.courses(TERM)],
+                         ['10001', '10002', '10003'])
+
+    def test_failed_detail_allow_partial(self):
+        catalog = self.catalog(FakeRegistrar(['10001', '10002', '10003'], failing={'10002'}))
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(catalog.build(TERM, allow_partial=True), 2)
+        self.assertEqual([course.crn for course in catalog.courses(TERM)], ['10001', '10003'])
+
+if __name__ == '__main__':
+    unittest.main()
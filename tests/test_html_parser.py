@@ -0,0 +1,141 @@
+"""
+Checks that every installed tree builder parses Registrar and Sisweb pages
+into the same results as the default 'html.parser'.
+
+Pages in tests/pages/<site> are named after the parser they are checked with,
+e.g. course_detail_*.html. Record real pages with tests/record_pages.py.
+"""
+from bs4.builder import builder_registry
+from davislib import Course, Registrar, Sisweb, Term, set_html_parser
+from davislib.models import DEFAULT_HTML_PARSER, html_parser
+import datetime
+import glob
+import os
+import unittest
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'pages')
+TERM = Term(2015, 'fall')
+CRN = '12345'
+
+# Tree builders checked against DEFAULT_HTML_PARSER, when installed
+BACKENDS = [name for name in ('lxml', 'html5lib') if builder_registry.lookup(name)]
+
+def course_attrs(course):
+    return {name: getattr(course, name, None) for name in Course.__slots__}
+
+# Maps (site, page name prefix) to function returning comparable results of parsing page
+PAGE_PARSERS = {
+    ('registrar', 'course_detail_'):
+        lambda text: course_attrs(Registrar()._course_from_detail_page(text, TERM, CRN)),
+    ('sisweb', 'term_select_'):
+        lambda text: Sisweb(None, None)._term_list(text),
+    ('sisweb', 'grades_'):
+        lambda text: Sisweb(None, None)._parse_grades(text),
+    ('sisweb', 'course_search_'):
+        lambda text: [course_attrs(course)
+                      for course in Sisweb(None, None)._parse_course_query(text, TERM)],
+    ('sisweb', 'course_schedule_'):
+        lambda text: Sisweb(None, None)._parse_courses_enrolled(text)}
+
+def pages():
+    """
+    Returns sorted list of tuple (site, page name) of pages in PAGES_DIR
+    """
+    paths = glob.glob(os.path.join(PAGES_DIR, '*', '*.html'))
+    return sorted((os.path.basename(os.path.dirname(path)), os.path.basename(path))
+                  for path in paths)
+
+def read_page(site, name):
+    with open(os.path.join(PAGES_DIR, site, name), encoding='utf-8') as f:
+        return f.read()
+
+def page_parser(site, name):
+    for (parser_site, prefix), parse in PAGE_PARSERS.items():
+        if site == parser_site and name.startswith(prefix):
+            return parse
+    raise ValueError('No parser for {}/{}'.format(site, name))
+
+def parse(site, name, parser):
+    """
+    Returns results of parsing page with tree builder parser
+    """
+    previous = html_parser()
+    set_html_parser(parser)
+    try:
+        return page_parser(site, name)(read_page(site, name))
+    finally:
+        set_html_parser(previous)
+
+class TestSetHtmlParser(unittest.TestCase):
+    def tearDown(self):
+        set_html_parser(DEFAULT_HTML_PARSER)
+
+    def test_falls_back_when_not_installed(self):
+        self.assertEqual(set_html_parser('not-a-builder'), DEFAULT_HTML_PARSER)
+        self.assertEqual(html_parser(), DEFAULT_HTML_PARSER)
+
+    def test_first_installed_is_selected(self):
+        self.assertEqual(set_html_parser('not-a-builder', 'html.parser'), 'html.parser')
+
+    @unittest.skipUnless('lxml' in BACKENDS, 'lxml is not installed')
+    def test_selects_lxml(self):
+        self.assertEqual(set_html_parser('lxml'), 'lxml')
+        self.assertEqual(html_parser(), 'lxml')
+
+class TestBackendEquivalence(unittest.TestCase):
+    def test_pages(self):
+        # Every page is checked, and yields results
+        self.assertTrue(pages())
+        for site, name in pages():
+            with self.subTest(page='{}/{}'.format(site, name)):
+                self.assertTrue(parse(site, name, DEFAULT_HTML_PARSER))
+
+    def test_default_parser(self):
+        attrs = parse('registrar', 'course_detail_ecs_060_a01.html', DEFAULT_HTML_PARSER)
+        self.assertEqual(attrs['name'], 'ECS 060')
+        self.assertEqual(attrs['section'], 'A01')
+        self.assertEqual(attrs['title'], 'Data Structures and Programming')
+        self.assertEqual(attrs['units'], 4.0)
+        self.assertEqual(attrs['instructor'], 'Sean Davis')
+        self.assertEqual(attrs['subject'], 'Engineering Computer Science')
+        self.assertEqual(attrs['ge_areas'], ['Science & Engineering', 'Quantitative Literacy'])
+        self.assertEqual((attrs['available_seats'], attrs['max_enrollment']), (12, 99))
+        self.assertEqual(attrs['final_exam'], datetime.datetime(2015, 12, 7, 10, 30))
+        self.assertEqual(attrs['drop_time'], 20)
+        self.assertEqual(attrs['prerequisites'], 'Course 040 or 030; Course 020')
+        self.assertEqual([(m.days, m.start, m.end, m.location) for m in attrs['meetings']],
+                         [('MWF', 600, 650, 'Wellman 2'), ('R', 730, 780, 'Olson 206')])
+
+        attrs = parse('registrar', 'course_detail_cst_100.html', DEFAULT_HTML_PARSER)
+        self.assertEqual(attrs['title'], 'Film & Media R&D Lab')
+        self.assertEqual(attrs['units'], (1.0, 5.0))
+        self.assertEqual(attrs['final_exam'], 'See Instructor')
+
+        grades = parse('sisweb', 'grades_201410.html', DEFAULT_HTML_PARSER)
+        self.assertEqual(grades['40658'], {'letter': 'B+', 'units_enrolled': 4.0,
+                                           'units_completed': 4.0, 'units_attempted': 4.0,
+                                           'grade_points': 13.2})
+        self.assertEqual(len(grades), 4)
+
+        courses = parse('sisweb', 'course_search_ecs_201510.html', DEFAULT_HTML_PARSER)
+        self.assertEqual([(c['crn'], c['name'], c['available_seats'], c['wl_length'])
+                          for c in courses],
+                         [('12345', 'ECS 060', '12', '0'), ('12346', 'ECS 122A', '0', '12'),
+                          ('12347', 'ECS 199', '5', '0')])
+
+        self.assertEqual(parse('sisweb', 'term_select_grades.html', DEFAULT_HTML_PARSER),
+                         [Term(2015, 'fall'), Term(2015, 'spring'),
+                          Term(2015, 'winter'), Term(2014, 'fall')])
+        self.assertEqual(parse('sisweb', 'course_schedule_201510.html', DEFAULT_HTML_PARSER),
+                         ['12345', '12346', '12347'])
+
+    @unittest.skipUnless(BACKENDS, 'no tree builder besides html.parser is installed')
+    def test_backends_match_default(self):
+        for site, name in pages():
+            expected = parse(site, name, DEFAULT_HTML_PARSER)
+            for backend in BACKENDS:
+                with self.subTest(page='{}/{}'.format(site, name), backend=backend):
+                    self.assertEqual(parse(site, name, backend), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Checks that Meeting stays readable as the dictionary formerly used for meetings
+"""
+from davislib import Meeting
+from datetime import timedelta
+import unittest
+
+FORMER = {'days': 'MWF',
+          'times': (timedelta(hours=10), timedelta(hours=10, minutes=50)),
+          'location': 'Wellman 2',
+          'type': 'LEC'}
+
+class TestMeeting(unittest.TestCase):
+    def setUp(self):
+        self.meeting = Meeting('MWF', 600, 650, 'Wellman 2', 'LEC')
+
+    def test_from_dict(self):
+        self.assertEqual(Meeting.from_dict(FORMER), self.meeting)
+
+    def test_mapping(self):
+        self.assertEqual(self.meeting['times'], FORMER['times'])
+        self.assertEqual(self.meeting.get('location'), 'Wellman 2')
+        self.assertIsNone(self.meeting.get('room'))
+        self.assertIn('days', self.meeting)
+        self.assertNotIn('room', self.meeting)
+        with self.assertRaises(KeyError):
+            self.meeting['room']
+
+    def test_keys_values_items(self):
+        self.assertEqual(list(self.meeting.keys()), list(FORMER.keys()))
+        self.assertEqual(list(self.meeting.values()), list(FORMER.values()))
+        self.assertEqual(list(self.meeting.items()), list(FORMER.items()))
+        self.assertEqual(dict(self.meeting), FORMER)
+
+    def test_tuple(self):
+        # Iteration, length and equality are those of the tuple
+        self.assertEqual(list(self.meeting), ['MWF', 600, 650, 'Wellman 2', 'LEC'])
+        self.assertEqual(len(self.meeting), 5)
+        self.assertNotEqual(self.meeting, FORMER)
+        self.assertEqual(self.meeting[0], 'MWF')
+
+    def test_tba(self):
+        meeting = Meeting('W', None, None, 'TBA')
+        self.assertIsNone(meeting['times'])
+        self.assertEqual(Meeting.from_dict(dict(meeting)), meeting)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""
+Checks Sisweb's detection of the page served in place of any page
+when the session ID is expired.
+"""
+from davislib import Sisweb
+import requests
+import unittest
+
+EXPIRED_PAGE = (b'<html><head>'
+                b'<meta http-equiv="refresh" content="0;url=/owa_service/owa/twbkwbis.P_GenMenu'
+                b'?name=bmenu.P_MainMnu&amp;msg=WELCOME">'
+                b'</head><body>%s</body></html>')
+
+def response(content, url=Sisweb.BASE + Sisweb.COURSE_QUERY_ENDPOINT):
+    r = requests.Response()
+    r.status_code = 200
+    r.url = url
+    r._content = content
+    return r
+
+class TestSessionExpired(unittest.TestCase):
+    def setUp(self):
+        self.sw = Sisweb(None, None)
+
+    def test_expired_page(self):
+        r = response(EXPIRED_PAGE % b'')
+        self.assertTrue(self.sw._session_expired(r))
+        self.assertFalse(self.sw._cacheable(r))
+
+    def test_large_expired_page(self):
+        # e.g. the redirect page with a full navigation menu and banner
+        r = response(EXPIRED_PAGE % (b'<p>Welcome to Sisweb</p>\n' * 500))
+        self.assertGreater(len(r.content), 2048)
+        self.assertTrue(self.sw._session_expired(r))
+        self.assertFalse(self.sw._cacheable(r))
+
+    def test_page(self):
+        r = response(b'<html><body><table class="datadisplaytable"></table></body></html>')
+        self.assertFalse(self.sw._session_expired(r))
+        self.assertTrue(self.sw._cacheable(r))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Checks SeatWatcher's polling intervals and the course queries it sends
+"""
+from davislib import Term
+from davislib.watcher import SeatWatcher
+from collections import namedtuple
+import unittest
+
+TERM = Term(2015, 'fall')
+
+Section = namedtuple('Section', ['crn', 'available_seats', 'wl_length'])
+
+class FakeScheduleBuilder(object):
+    """
+    Answers course queries with seats, or raises error if set
+    """
+    def __init__(self):
+        self.seats = {'10001': (3, 0), '10002': (0, 5)}
+        self.error = None
+        self.queries = list()
+
+    def course_query(self, term, **kwargs):
+        self.queries.append(kwargs)
+        if self.error:
+            raise self.error
+        return [Section(crn, *seats) for crn, seats in self.seats.items()]
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestSeatWatcher(unittest.TestCase):
+    def setUp(self):
+        self.sb = FakeScheduleBuilder()
+        self.clock = Clock()
+        self.watcher = SeatWatcher(self.sb, registrar=object(), min_interval=10,
+                                   max_interval=100, backoff=2, clock=self.clock)
+        self.watcher.watch(TERM, '10001', subject='ECS')
+        self.watcher.watch(TERM, '10002', subject='ECS')
+        self.group = self.watcher._groups[(TERM, 'ECS')]
+
+    def poll(self):
+        self.clock.now = self.group.next_poll
+        return self.watcher.poll()
+
+    def test_queries_seat_fields_only(self):
+        self.poll()
+        self.assertEqual(self.sb.queries, [{'subject': 'ECS', 'lazy': True, 'fields': ()}])
+
+    def test_changes(self):
+        self.assertEqual(self.poll(), [])
+        self.sb.seats['10001'] = (2, 0)
+        changes = self.poll()
+        self.assertEqual([(c.crn, c.available_seats, c.previous_available_seats)
+                          for c in changes], [('10001', 2, 3)])
+
+    def test_intervals(self):
+        self.poll()
+        self.assertEqual(self.group.interval, 20) # quiet
+        self.sb.seats['10002'] = (0, 4)
+        self.poll()
+        self.assertEqual(self.group.interval, 10) # active
+
+    def test_failure_keeps_interval(self):
+        self.poll()
+        interval = self.group.interval
+        self.sb.error = ConnectionError()
+        for _ in range(5):
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(self.poll(), [])
+        self.assertEqual(self.group.interval, interval)
+        self.assertEqual(self.group.next_poll, self.clock.now + interval)
+
+        # Changes during the outage are reported on recovery
+        self.sb.error = None
+        self.sb.seats['10001'] = (0, 0)
+        self.assertEqual([c.crn for c in self.poll()], ['10001'])
+
+if __name__ == '__main__':
+    unittest.main()